@@ -0,0 +1,85 @@
+"""
+Benchmark the peak memory of parsing a .bpstat file, streaming vs. reading it whole.
+
+Writes synthetic .bpstat files of increasing size and walks through every record of each,
+without keeping them, with:
+  - original: the old get_songs() approach (read the file, decode it, split it into lines)
+  - streaming: bpparse.iter_songs()
+Each measurement runs in a fresh process. Peak memory should grow with the file for the
+original approach and stay flat (about one record) for the streaming parser.
+
+Usage: python benchmarks/bench_bpstat.py [number of lines ...]
+"""
+
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bpparse
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+
+def iter_songs_original(filepath):
+    """bpparse.get_songs() as it was before the streaming parser, yielding instead of collecting."""
+    with open(filepath, 'rb') as file:
+        contents = file.read().decode('utf-8')
+    lines = contents.split("\n")
+
+    for entry in lines:
+        fields = entry.split(";")
+        if len(fields) != 8:
+            continue
+        yield bpparse.BPSong(*fields)
+
+PARSERS = {"original": iter_songs_original, "streaming": bpparse.iter_songs}
+
+def write_bpstat(filepath, num_lines):
+    with open(filepath, "w", encoding="utf-8") as f:
+        for index in range(num_lines):
+            f.write(f"{index % 100};0;Song {index};Artist {index % 500};Album {index % 2000};"
+                    f"/storage/music/{index:016X}.mp3;1600000000000;1600000000000\n")
+
+def measure(parser_name, filepath):
+    """Parse `filepath` with one parser, printing the peak traced and resident memory in KiB."""
+    parse = PARSERS[parser_name]
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in parse(filepath):
+        pass
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # ru_maxrss is in KiB on Linux (bytes on macOS)
+    print(peak // 1024, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, f"{elapsed:.3f}")
+
+def main(sizes):
+    folder = tempfile.mkdtemp(prefix="bpsync-bench-")
+    print(f"{'lines':>9} {'file KiB':>9} {'parser':>10} {'peak KiB':>9} {'max RSS KiB':>12} {'seconds':>8}")
+    for num_lines in sorted(sizes):
+        filepath = os.path.join(folder, f"{num_lines}.bpstat")
+        write_bpstat(filepath, num_lines)
+        file_kib = os.path.getsize(filepath) // 1024
+
+        for parser_name in PARSERS:
+            result = subprocess.run([sys.executable, __file__, "--measure", parser_name, filepath],
+                                    capture_output=True, text=True, check=True)
+            peak_kib, max_rss_kib, seconds = result.stdout.split()
+            print(f"{num_lines:>9} {file_kib:>9} {parser_name:>10} {peak_kib:>9} {max_rss_kib:>12} {seconds:>8}")
+
+        os.remove(filepath)
+    os.rmdir(folder)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3])
+    else:
+        main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,114 @@
+"""
+Benchmark writing ExportImport files as more fields are selected.
+
+Writes a synthetic library with the first 1, 4, 8, 16 and all 28 ExportImport fields
+selected, using both the original per-field lookup loop and bpsynctools.add_to_exportimport().
+The cost per song-field should stay flat as more fields are selected.
+
+Usage: python benchmarks/bench_exportimport.py [number of songs]
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bpsynctools
+
+DEFAULT_SONGS = 50_000
+FIELD_COUNTS = (1, 4, 8, 16, len(bpsynctools.EXPORTIMPORT_ATTRS))
+
+def write_exportimport_original(lib, selected_fields, output_path):
+    """add_to_exportimport() as it was before the precompiled formatters."""
+    attrs = bpsynctools.EXPORTIMPORT_ATTRS
+
+    with open(output_path, "w", encoding="utf-16") as fp:
+        fp.write("")
+
+    with open(output_path, "a", encoding="utf-16") as fp:
+        for _, song in lib.songs.items():
+            fp.write(f"<ID>{song.persistent_id[0:8]}-{song.persistent_id[8:16]}\n")
+
+            for field in selected_fields:
+                attr_name = attrs[field]
+                field_value = getattr(song, attr_name)
+
+                if attr_name in ["date_added", "skip_date", "lastplayed"]:
+                    if field_value == None:
+                        field_value = "12:00:00 AM"
+                    else:
+                        field_value = time.strftime("%m/%d/%Y %I:%M:%S %p", field_value)
+                elif attr_name in ["play_count", "skip_count"]:
+                    if field_value == None:
+                        field_value = 0
+                elif attr_name in ["start_time", "stop_time"]:
+                    if field_value == None:
+                        if attr_name == "start_time":
+                            field_value = 0
+                        else:
+                            field_value = song.total_time // 100
+                    else:
+                        field_value = field_value // 100
+                else:
+                    if field_value == None:
+                        field_value = ""
+
+                fp.write(f"<{field}>{field_value}\n")
+
+            fp.write("\n")
+
+def make_library(num_songs):
+    """Create a stand-in for a libpytunes Library with every field ExportImport can write."""
+    added = time.localtime(1600000000)
+    songs = {}
+    for index in range(num_songs):
+        song = SimpleNamespace(**{attr_name: None for attr_name in bpsynctools.EXPORTIMPORT_ATTRS.values()})
+        song.persistent_id = f"{index:016X}"
+        song.location = f"/music/{song.persistent_id}.mp3"
+        song.name = f"Song {index}"
+        song.artist = f"Artist {index % 500}"
+        song.album = f"Album {index % 2000}"
+        song.date_added = added
+        song.lastplayed = added if index % 2 else None
+        song.play_count = index % 50 or None
+        song.track_number = index % 20 + 1
+        song.year = 2000 + index % 20
+        song.bit_rate = 320
+        song.kind = "MPEG audio file"
+        song.total_time = 200000
+        songs[index] = song
+    return SimpleNamespace(songs=songs)
+
+def main(num_songs):
+    lib = make_library(num_songs)
+    all_fields = list(bpsynctools.EXPORTIMPORT_ATTRS)
+    output_path = os.path.join(tempfile.mkdtemp(prefix="bpsync-bench-"), "exportimport.txt")
+
+    print(f"{num_songs} songs")
+    print(f"{'fields':>6} {'writer':>9} {'seconds':>8} {'us/song':>8} {'us/song-field':>14}")
+    for num_fields in FIELD_COUNTS:
+        selected_fields = all_fields[:num_fields]
+        outputs = []
+        for name, write in (("original", write_exportimport_original),
+                            ("compiled", bpsynctools.add_to_exportimport)):
+            start = time.perf_counter()
+            write(lib, selected_fields, output_path)
+            elapsed = time.perf_counter() - start
+
+            with open(output_path, "rb") as f:
+                outputs.append(f.read())
+            per_song = elapsed / num_songs * 1e6
+            print(f"{num_fields:>6} {name:>9} {elapsed:>8.3f} {per_song:>8.2f} {per_song / num_fields:>14.3f}")
+
+        assert outputs[0] == outputs[1], "The writers' output differs"
+
+    os.remove(output_path)
+    os.rmdir(os.path.dirname(output_path))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SONGS)
@@ -0,0 +1,74 @@
+"""
+Benchmark FileHashCache.prefetch() against the original serial, 8 KiB-read file hashing.
+
+Writes a synthetic corpus of song-sized files (10 GB by default), then hashes all of it
+once with each. Both produce the same hashes; only the throughput differs. A corpus
+larger than RAM measures the disk, and one that fits in the page cache measures hashing.
+
+Usage: python benchmarks/bench_hashing.py [corpus size in GB] [file size in MB]
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+
+DEFAULT_CORPUS_GB = 10
+DEFAULT_FILE_MB = 8
+
+def calculate_file_hash_original(filepath):
+    """models.calculate_file_hash() as it was before the hashing engine."""
+    with open(filepath, "rb") as f:
+        file_hash = hashlib.blake2b()
+        while chunk := f.read(8192):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def write_corpus(folder, corpus_bytes, file_bytes):
+    """Fill `folder` with random files adding up to `corpus_bytes`, returning their paths."""
+    paths = []
+    block = os.urandom(file_bytes)
+    for index in range(max(1, corpus_bytes // file_bytes)):
+        path = os.path.join(folder, f"{index:06}.mp3")
+        with open(path, "wb") as f:
+            # vary each file a little, so no two have the same hash
+            f.write(index.to_bytes(8, "little"))
+            f.write(block)
+        paths.append(path)
+    return paths
+
+def main(corpus_gb, file_mb):
+    folder = tempfile.mkdtemp(prefix="bpsync-bench-")
+    try:
+        paths = write_corpus(folder, int(corpus_gb * 1024**3), int(file_mb * 1024**2))
+        total_bytes = sum(os.path.getsize(path) for path in paths)
+        print(f"{len(paths)} files, {total_bytes / 1024**3:.2f} GiB")
+
+        start = time.perf_counter()
+        original_hashes = {path: calculate_file_hash_original(path) for path in paths}
+        original_seconds = time.perf_counter() - start
+
+        cache = models.FileHashCache()
+        start = time.perf_counter()
+        cache.prefetch(paths)
+        prefetch_seconds = time.perf_counter() - start
+
+        assert all(cache.entries[path][3] == original_hashes[path] for path in paths)
+
+        for name, seconds in (("original", original_seconds), ("prefetch", prefetch_seconds)):
+            print(f"{name:>9}: {seconds:7.2f}s  {total_bytes / 1024**2 / seconds:8.1f} MiB/s")
+        print(f"  speedup: {original_seconds / prefetch_seconds:.2f}x on {os.cpu_count()} CPUs")
+    finally:
+        shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    arguments = [float(argument) for argument in sys.argv[1:3]]
+    main(*arguments, *(DEFAULT_CORPUS_GB, DEFAULT_FILE_MB)[len(arguments):])
@@ -0,0 +1,98 @@
+"""
+Benchmark bpsynctools.standard_sync_arrays_from_data() on synthetic libraries.
+
+Builds a database, .bpstat collection and library of each size (90% tracked, 5% ignored,
+5% new), then times what the standard sync window does before drawing its tables: the
+bulk read of every StoredSong (done by get_std_data()) and resolving the library against
+them. The time per track should stay flat as the library grows, and 100k tracks should
+take under a second.
+
+Usage: python benchmarks/bench_resolver.py [number of tracks ...]
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bpparse
+import bpsynctools
+import models
+
+DEFAULT_SIZES = (10_000, 25_000, 50_000, 100_000)
+TARGET_SECONDS = 1.0
+
+def make_song(index):
+    """Create a stand-in for a libpytunes Song with every field the resolver reads."""
+    song = SimpleNamespace(**{field_name: None for field_name in models.REPROCESSING_FIELDS})
+    song.persistent_id = f"{index:016X}"
+    song.name = f"Song {index}"
+    song.artist = f"Artist {index % 500}"
+    song.album = f"Album {index % 2000}"
+    song.track_number = index % 20 + 1
+    song.year = 2000 + index % 20
+    song.bit_rate = 320
+    song.sample_rate = 44100
+    song.kind = "MPEG audio file"
+    song.play_count = index % 50
+    song.location = f"/music/{song.persistent_id}.mp3"
+    return song
+
+def build(num_tracks):
+    """Fill a fresh database and return the library and .bpstat songs to resolve."""
+    models.initialize_engine(tempfile.mkdtemp(prefix="bpsync-bench-"))
+    models.create_db()
+
+    library = {}
+    stored_rows = []
+    ignored_ids = []
+    bpsongs = []
+    for index in range(num_tracks):
+        song = make_song(index)
+        library[index] = song
+
+        kind = index % 20
+        if kind == 0:
+            ignored_ids.append(song.persistent_id)
+        elif kind != 1:
+            row = {field_name: getattr(song, field_name) for field_name in models.REPROCESSING_FIELDS}
+            row.update(persistent_id=song.persistent_id, last_playcount=song.play_count)
+            stored_rows.append(row)
+            bpsongs.append(bpparse.BPSong(song.play_count + 1, 0, song.name, song.artist, song.album,
+                                          f"{song.persistent_id}.mp3", 1600000000000, 1600000000000))
+
+    models.upsert_rows(models.StoredSong.__table__, stored_rows)
+    models.add_ignored_ids(ignored_ids)
+
+    return library, bpparse.BPSongCollection(bpsongs), len(ignored_ids)
+
+def main(sizes):
+    print(f"{'tracks':>8} {'load s':>9} {'resolve s':>9} {'total s':>9} {'us/track':>9}")
+    for num_tracks in sorted(sizes):
+        library, bpstat_songs, num_ignored = build(num_tracks)
+
+        start = time.perf_counter()
+        with models.Session() as session:
+            stored_songs = {db_song.persistent_id: db_song for db_song in session.query(models.StoredSong)}
+        loaded = time.perf_counter()
+        existing_rows, new_rows = bpsynctools.standard_sync_arrays_from_data(library, bpstat_songs, False,
+                                                                            stored_songs=stored_songs)
+        resolved = time.perf_counter()
+        elapsed = resolved - start
+
+        assert len(existing_rows) + len(new_rows) == num_tracks - num_ignored
+        print(f"{num_tracks:>8} {loaded - start:>9.3f} {resolved - loaded:>9.3f} {elapsed:>9.3f} "
+              f"{elapsed / num_tracks * 1e6:>9.2f}")
+
+    if num_tracks >= 100_000 and elapsed >= TARGET_SECONDS:
+        print(f"Resolving {num_tracks} tracks took longer than {TARGET_SECONDS}s")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES))
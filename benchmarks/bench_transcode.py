@@ -0,0 +1,80 @@
+"""
+Benchmark the ffmpeg processing engine against the pydub one, as tracks get longer.
+
+Generates MP3s of increasing length with ffmpeg, then processes each one in a fresh
+process with either engine (trimmed, with a volume adjustment) and measures:
+  - seconds to process the song
+  - peak RSS of the Python process, and of the largest subprocess (ffmpeg/ffprobe)
+The pydub engine's Python process grows with the track, since the whole song is decoded
+into memory; the ffmpeg engine's should stay flat. Needs ffmpeg on the PATH.
+
+Usage: python benchmarks/bench_transcode.py [track length in minutes ...]
+"""
+
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_MINUTES = (3, 15, 60)
+ENGINES = ("ffmpeg", "pydub")
+
+def write_track(track_path, minutes):
+    """Encode a stereo test tone of `minutes` minutes, with tags, into an MP3."""
+    subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+                    "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={minutes * 60}",
+                    "-ac", "2", "-metadata", "title=Benchmark", "-metadata", "artist=bpsync",
+                    "-codec:a", "libmp3lame", "-b:a", "320k", track_path], check=True)
+
+def measure(engine, track_path, minutes):
+    """Process `track_path` with one engine, printing the time and peak RSS (in KiB on Linux)."""
+    import bpsynctools
+
+    length_ms = int(minutes * 60_000)
+    song = SimpleNamespace(location=track_path, persistent_id="0123456789ABCDEF", name="Benchmark",
+                           start_time=1000, stop_time=length_ms - 1000, volume_adjustment=-50)
+    output_path = f"{track_path}.{engine}.mp3"
+    transcode = {"ffmpeg": bpsynctools.transcode_with_ffmpeg, "pydub": bpsynctools.transcode_with_pydub}[engine]
+
+    start = time.perf_counter()
+    transcode(song, output_path)
+    elapsed = time.perf_counter() - start
+    os.remove(output_path)
+
+    print(f"{elapsed:.3f}", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+          resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def main(lengths):
+    if not shutil.which("ffmpeg"):
+        sys.exit("ffmpeg needs to be on the PATH to generate tracks and run the ffmpeg engine")
+
+    folder = tempfile.mkdtemp(prefix="bpsync-bench-")
+    print(f"{'minutes':>7} {'MiB':>6} {'engine':>7} {'seconds':>8} {'Python RSS MiB':>15} {'child RSS MiB':>14}")
+    try:
+        for minutes in sorted(lengths):
+            track_path = os.path.join(folder, f"{minutes}.mp3")
+            write_track(track_path, minutes)
+            track_mib = os.path.getsize(track_path) / 1024**2
+
+            for engine in ENGINES:
+                result = subprocess.run([sys.executable, __file__, "--measure", engine, track_path, str(minutes)],
+                                        capture_output=True, text=True, check=True)
+                seconds, self_rss_kib, child_rss_kib = result.stdout.split()
+                print(f"{minutes:>7} {track_mib:>6.1f} {engine:>7} {seconds:>8} "
+                      f"{int(self_rss_kib) / 1024:>15.1f} {int(child_rss_kib) / 1024:>14.1f}")
+    finally:
+        shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3], float(sys.argv[4]))
+    else:
+        main([float(minutes) for minutes in sys.argv[1:]] or DEFAULT_MINUTES)
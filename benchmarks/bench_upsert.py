@@ -0,0 +1,99 @@
+"""
+Benchmark the StoredSong/IgnoredSong bulk upserts against the original ORM write paths.
+
+Each case runs against a fresh SQLite database in a temporary folder:
+  - original insert: StoredSong objects through session.bulk_save_objects(), as
+    add_libpy_songs() used to (only possible on an empty table)
+  - original update: one ORM query and update per song, as StandardWorker.run() used to
+    (run on a sample of the rows, since it's slow)
+  - upsert insert / upsert update: models.add_stored_song_rows() into an empty/full table
+  - ignored upsert: models.add_ignored_ids() into an empty/full table
+File hashing isn't included; every row already has its hash.
+
+Usage: python benchmarks/bench_upsert.py [number of rows] [rows in the original update sample]
+"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+
+DEFAULT_ROWS = 100_000
+DEFAULT_UPDATE_SAMPLE = 5_000
+
+def make_rows(num_rows, play_count_offset=0):
+    rows = []
+    for index in range(num_rows):
+        row = {field_name: None for field_name in models.REPROCESSING_FIELDS}
+        row.update(persistent_id=f"{index:016X}", last_playcount=index % 50 + play_count_offset,
+                   blake2b_hash="0" * 128, equalizer=None, name=f"Song {index}",
+                   artist=f"Artist {index % 500}", album=f"Album {index % 2000}",
+                   track_number=index % 20 + 1, year=2000 + index % 20, bit_rate=320,
+                   sample_rate=44100, kind="MPEG audio file")
+        rows.append(row)
+    return rows
+
+def fresh_database(folder):
+    """Point the models at an empty database in `folder`, deleting any earlier one."""
+    if models.engine is not None:
+        models.engine.dispose()
+    shutil.rmtree(folder, ignore_errors=True)
+    os.mkdir(folder)
+    models.initialize_engine(folder)
+    models.create_db()
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def original_insert(rows):
+    with models.Session() as session:
+        session.bulk_save_objects([models.StoredSong(**row) for row in rows])
+        session.commit()
+
+def original_update(rows):
+    with models.Session() as session:
+        for row in rows:
+            db_song = session.query(models.StoredSong).filter(
+                models.StoredSong.persistent_id == row["persistent_id"]).scalar()
+            db_song.last_playcount = row["last_playcount"]
+        session.commit()
+
+def main(num_rows, update_sample):
+    rows = make_rows(num_rows)
+    updated_rows = make_rows(num_rows, play_count_offset=1)
+    ids = [row["persistent_id"] for row in rows]
+    folder = os.path.join(tempfile.mkdtemp(prefix="bpsync-bench-"), "db")
+    results = []
+
+    fresh_database(folder)
+    results.append(("original insert", num_rows, timed(original_insert, rows)))
+    results.append(("original update", update_sample, timed(original_update, updated_rows[:update_sample])))
+
+    fresh_database(folder)
+    results.append(("upsert insert", num_rows, timed(models.add_stored_song_rows, rows)))
+    results.append(("upsert update", num_rows, timed(models.add_stored_song_rows, updated_rows)))
+    with models.Session() as session:
+        assert session.query(models.StoredSong).filter(models.StoredSong.last_playcount == 0).count() == 0, \
+            "The upsert didn't update every row"
+
+    results.append(("ignored insert", num_rows, timed(models.add_ignored_ids, ids)))
+    results.append(("ignored update", num_rows, timed(models.add_ignored_ids, ids)))
+    models.engine.dispose()
+    shutil.rmtree(os.path.dirname(folder))
+
+    print(f"{'case':>16} {'rows':>8} {'seconds':>8} {'rows/s':>9}")
+    for name, count, seconds in results:
+        print(f"{name:>16} {count:>8} {seconds:>8.3f} {count / seconds:>9.0f}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    arguments = [int(argument) for argument in sys.argv[1:3]]
+    main(*arguments, *(DEFAULT_ROWS, DEFAULT_UPDATE_SAMPLE)[len(arguments):])
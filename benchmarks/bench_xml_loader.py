@@ -0,0 +1,114 @@
+"""
+Benchmark loading an iTunes XML with itunesxml.StreamingLibrary against libpytunes.Library.
+
+Writes synthetic iTunes XMLs of increasing size, then loads each one in a fresh process
+with either loader and measures:
+  - time to first row: until the first-time sync table's first row can be built
+  - time to all rows: until every row has been built
+  - peak RSS of the process
+The streaming loader should reach its first row sooner and use a fraction of the memory.
+
+Usage: python benchmarks/bench_xml_loader.py [number of tracks ...]
+"""
+
+import datetime
+import logging
+import os
+import plistlib
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_SIZES = (10_000, 50_000)
+LOADERS = ("libpytunes", "streaming")
+
+def write_library_xml(xml_path, num_tracks):
+    """Write an iTunes XML with `num_tracks` tracks carrying the usual fields."""
+    added = datetime.datetime(2020, 9, 13, 12, 26, 40)
+    tracks = {}
+    for track_id in range(1, num_tracks + 1):
+        persistent_id = f"{track_id:016X}"
+        tracks[str(track_id)] = {
+            "Track ID": track_id,
+            "Persistent ID": persistent_id,
+            "Name": f"Song {track_id}",
+            "Artist": f"Artist {track_id % 500}",
+            "Album Artist": f"Artist {track_id % 500}",
+            "Album": f"Album {track_id % 2000}",
+            "Genre": "Electronic",
+            "Kind": "MPEG audio file",
+            "Size": 8_000_000 + track_id,
+            "Total Time": 200_000,
+            "Track Number": track_id % 20 + 1,
+            "Year": 2000 + track_id % 20,
+            "Date Modified": added,
+            "Date Added": added,
+            "Bit Rate": 320,
+            "Sample Rate": 44100,
+            "Play Count": track_id % 50,
+            "Play Date UTC": added,
+            "Track Type": "File",
+            "Location": f"file://localhost/C:/Music/{persistent_id}.mp3",
+        }
+
+    library = {
+        "Major Version": 1,
+        "Minor Version": 1,
+        "Application Version": "12.12.4.1",
+        "Music Folder": "file://localhost/C:/Music/",
+        "Library Persistent ID": "0123456789ABCDEF",
+        "Tracks": tracks,
+        "Playlists": [],
+    }
+    with open(xml_path, "wb") as f:
+        plistlib.dump(library, f, sort_keys=False)
+
+def measure(loader, xml_path):
+    """Load `xml_path` with one loader, printing its timings and peak RSS (in KiB on Linux)."""
+    import bpsynctools
+    import itunesxml
+    import libpytunes
+
+    start = time.perf_counter()
+    if loader == "libpytunes":
+        songs = libpytunes.Library(xml_path).songs
+    else:
+        songs = itunesxml.StreamingLibrary(xml_path).records
+
+    rows = bpsynctools.iter_first_sync_rows(songs)
+    next(rows)
+    first_row = time.perf_counter() - start
+    for _ in rows:
+        pass
+    all_rows = time.perf_counter() - start
+
+    print(f"{first_row:.3f}", f"{all_rows:.3f}", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def main(sizes):
+    folder = tempfile.mkdtemp(prefix="bpsync-bench-")
+    print(f"{'tracks':>8} {'XML MiB':>8} {'loader':>10} {'first row s':>12} {'all rows s':>11} {'max RSS MiB':>12}")
+    for num_tracks in sorted(sizes):
+        xml_path = os.path.join(folder, f"{num_tracks}.xml")
+        write_library_xml(xml_path, num_tracks)
+        xml_mib = os.path.getsize(xml_path) / 1024**2
+
+        for loader in LOADERS:
+            result = subprocess.run([sys.executable, __file__, "--measure", loader, xml_path],
+                                    capture_output=True, text=True, check=True)
+            first_row, all_rows, max_rss_kib = result.stdout.split()
+            print(f"{num_tracks:>8} {xml_mib:>8.1f} {loader:>10} {first_row:>12} {all_rows:>11} "
+                  f"{int(max_rss_kib) / 1024:>12.1f}")
+
+        os.remove(xml_path)
+    os.rmdir(folder)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3])
+    else:
+        main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
@@ -2,6 +2,9 @@ import time
 from datetime import datetime
 import logging
 import os
+import shutil
+import sys
+import tempfile
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -12,7 +15,13 @@ class BPSong:
 
     All fields are present in order in a .bpstat file and are required.
     For internal purposes, note that `filepath` should be unique across all BPSong objects.
+
+    Dates are stored as integer millisecond timestamps, exactly as they appear in the
+    .bpstat; `addition_date` and `last_played` convert them to datetimes on access.
     """
+    # Large .bpstats have tens of thousands of these, so avoid a per-instance __dict__
+    __slots__ = ("total_plays", "plays_this_month", "title", "artist", "album", "filepath",
+                 "addition_timestamp", "last_played_timestamp", "persistent_id")
 
     def __init__(self, plays, plays_this_month, title, artist, album, filepath, addition_date, last_played):
         self.total_plays = int(plays)
@@ -21,8 +30,9 @@ class BPSong:
         self.artist = artist
         self.album = album
         self.filepath = filepath
-        self.addition_date = datetime.utcfromtimestamp(int(addition_date) / 1000)
-        self.last_played = datetime.utcfromtimestamp(int(last_played) / 1000)
+        self.addition_timestamp = int(addition_date)
+        self.last_played_timestamp = int(last_played)
+        self.persistent_id = self._parse_persistent_id()
 
     @classmethod
     def from_song(cls, song):
@@ -38,17 +48,24 @@ class BPSong:
         # No way to determine plays this month from XML data
         return cls(total_plays, 0, title, artist, album, filepath, addition_date, last_played)
 
+    @property
+    def addition_date(self):
+        return datetime.utcfromtimestamp(self.addition_timestamp / 1000)
+
+    @property
+    def last_played(self):
+        return datetime.utcfromtimestamp(self.last_played_timestamp / 1000)
+
     def as_bpstat_line(self, prefix_path):
         """Write as bpstat line with specified prepended filepath."""
-        # Convert back to timestamp in milliseconds
-        addition_date = int(datetime.timestamp(self.addition_date) * 1000)
+        addition_date = self.addition_timestamp
         last_played = 0
 
         # Support for songs that have never been played before to be exported to bpstat
         if self.total_plays == 0:
             last_played = addition_date
         else:
-            last_played = int(datetime.timestamp(self.last_played) * 1000)
+            last_played = self.last_played_timestamp
 
         path = os.path.join(prefix_path, self.filepath)
 
@@ -59,6 +76,14 @@ class BPSong:
         """
         Strip out the persistent ID out of the filepath, if available.
 
+        Returns None if the file name isn't a persistent ID; see _parse_persistent_id().
+        """
+        return self.persistent_id
+
+    def _parse_persistent_id(self):
+        """
+        Parse the persistent ID out of the filepath, interning it since it is used as a lookup key.
+
         This really just returns the file name without the extension, with minimal validation:
         - The file name is a valid hexadecimal number.
         - The file name is 16 characters long.
@@ -71,7 +96,7 @@ class BPSong:
             if len(filename) != 16:
                 raise ValueError()
 
-            return filename
+            return sys.intern(filename)
         except ValueError:
             return None
 
@@ -81,32 +106,153 @@ class BPSong:
         """
         return str(Path(self.filepath).parent)
 
+class BPSongCollection:
+    """
+    The songs of a .bpstat file, with an index by persistent ID.
+
+    Behaves like a read-only list of BPSong objects. The index is built once, when
+    the collection is created, so lookups by persistent ID are a single dict access.
+    """
+
+    def __init__(self, songs=()):
+        self.songs = list(songs)
+        self.by_persistent_id = {song.persistent_id: song for song in self.songs}
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __iter__(self):
+        return iter(self.songs)
+
+    def __getitem__(self, index):
+        return self.songs[index]
+
+    def get(self, persistent_id, default=None):
+        """Look up a song by persistent ID, returning `default` if it isn't present."""
+        return self.by_persistent_id.get(persistent_id, default)
+
+class BPStatWriter:
+    """
+    Buffered writer for .bpstat files, meant to be used as a context manager:
+
+        with BPStatWriter(bpstat_path, bpstat_prefix) as writer:
+            writer.write(bpsong)
+
+    All lines go through one buffered handle to a temporary file in the same folder.
+    When the `with` block exits normally, the temporary file atomically replaces
+    `filepath`; if it exits with an exception or abort() was called, `filepath` is
+    left untouched.
+
+    :param filepath: The full location of the .bpstat to write.
+    :param prefix_path: The folder used within the .bpstat for its filepath field.
+    :param append: If True and `filepath` already exists, keep its current lines
+        and write after them.
+    :param buffer_size: The size of the write buffer, in bytes.
+    """
+
+    def __init__(self, filepath, prefix_path, append=False, buffer_size=1024 * 1024):
+        self.filepath = filepath
+        self.prefix_path = prefix_path
+        self.append = append
+        self.buffer_size = buffer_size
+
+        self.file = None
+        self.temp_path = None
+        self.aborted = False
+        self.num_written = 0
+
+    def __enter__(self):
+        folder = os.path.dirname(os.path.abspath(self.filepath))
+        fd, self.temp_path = tempfile.mkstemp(dir=folder, suffix=".bpstat.tmp")
+        self.file = os.fdopen(fd, "wb", buffering=self.buffer_size)
+
+        if self.append and os.path.isfile(self.filepath):
+            with open(self.filepath, "rb") as existing:
+                shutil.copyfileobj(existing, self.file)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+
+        if exc_type or self.aborted:
+            os.remove(self.temp_path)
+            logger.info(f"Discarded {self.num_written} unsaved lines for {self.filepath}")
+        else:
+            os.replace(self.temp_path, self.filepath)
+            logger.info(f"Wrote {self.num_written} lines to {self.filepath}")
+
+        # Don't suppress exceptions
+        return False
+
+    def write(self, bpsong):
+        """Write a BPSong as one .bpstat line."""
+        self.file.write((bpsong.as_bpstat_line(self.prefix_path) + "\n").encode('utf-8'))
+        self.num_written += 1
+
+    def write_all(self, bpsongs):
+        """Write every BPSong from an iterable (which can be a generator)."""
+        for bpsong in bpsongs:
+            self.write(bpsong)
+
+    def abort(self):
+        """Discard everything written so far once the `with` block exits."""
+        self.aborted = True
+
 def get_songs(filepath):
     """
-    Parse a .bpstat file, returning an array of BPSong objects.
+    Parse a .bpstat file, returning its BPSong objects.
+
+    :param filepath: The filepath of the .bpstat file.
+    :return: A BPSongCollection containing the file's BPSong objects.
+    """
+    return BPSongCollection(iter_songs(filepath))
+
+def iter_songs(filepath):
+    """
+    Lazily parse a .bpstat file, yielding BPSong objects one at a time.
+
+    The file is read line by line as bytes, so only one record is held in memory at once.
+    Malformed lines are skipped and logged along with their byte offset in the file.
 
     :param filepath: The filepath of the .bpstat file.
-    :return: An array containing a list of BPSong objects.
     """
     with open(filepath, 'rb') as file:
-        contents = file.read().decode('utf-8')
-    lines = contents.split("\n")
-
-    # If there are the wrong number of fields/semicolons in a bpstat thing, it will not import correctly
-    # This also holds true in BlackPlayer itself; it can export a song with semicolons in its metadata,
-    # but will importing it because there are too many fields
-    songs = []
-    for entry in lines:
-        fields = entry.split(";")
-        if len(fields) > 8:
-            logger.warning(
-                f"Tried to import a song with an extra semicolon in its metadata - please remove it ({entry=})")
-            continue
-        elif len(fields) < 8:
-            # shouldn't ever happen unless the bpstat's been messed with, or an empty line was parsed
-            logger.warning(f"Song has fewer than 8 fields - is it a trailing newline? ({entry=})")
-            continue
-        song = BPSong(*fields)
-        songs.append(song)
-
-    return songs
+        offset = 0
+        for raw_line in file:
+            line_offset = offset
+            offset += len(raw_line)
+
+            entry = raw_line.rstrip(b"\r\n")
+            if not entry:
+                # Usually the trailing newline at the end of the file
+                continue
+
+            try:
+                entry = entry.decode('utf-8')
+            except UnicodeDecodeError as e:
+                logger.warning(f"Line at byte {line_offset} isn't valid UTF-8, skipping it ({e})")
+                continue
+
+            # If there are the wrong number of fields/semicolons in a bpstat thing, it will not import correctly
+            # This also holds true in BlackPlayer itself; it can export a song with semicolons in its metadata,
+            # but will importing it because there are too many fields
+            fields = entry.split(";")
+            if len(fields) > 8:
+                logger.warning(
+                    f"Tried to import a song with an extra semicolon in its metadata - please remove it "
+                    f"(byte {line_offset}, {entry=})")
+                continue
+            elif len(fields) < 8:
+                # shouldn't ever happen unless the bpstat's been messed with
+                logger.warning(f"Song has fewer than 8 fields (byte {line_offset}, {entry=})")
+                continue
+
+            try:
+                song = BPSong(*fields)
+            except ValueError as e:
+                # A playcount or timestamp that isn't a number
+                logger.warning(f"Song has an invalid numeric field (byte {line_offset}, {entry=}): {e}")
+                continue
+
+            yield song
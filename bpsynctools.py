@@ -6,14 +6,20 @@ import os
 import platform
 import subprocess
 import logging
+import logging.handlers
 import hashlib
+import pickle
+import signal
+import threading
 import time
 import xml
 
 from collections import namedtuple
+import shutil
 from shutil import copy2
 from datetime import datetime
 from math import log10
+from operator import attrgetter
 from pathlib import Path
 from dataclasses import dataclass
 
@@ -21,7 +27,6 @@ from PySide6 import QtWidgets
 from pydub import AudioSegment
 from pydub.utils import mediainfo
 from eyed3 import load
-import sqlalchemy.orm.exc
 import libpytunes
 
 from bpsyncwidgets import SongView
@@ -50,19 +55,84 @@ class TableStatistics:
 
 # region Processing
 
-def copy_and_process_song(song, output_folder='tmp'):
+# Upper bound on the size of the transcode cache, in bytes. Least recently used
+# entries are removed by evict_transcode_cache() once this is exceeded.
+TRANSCODE_CACHE_MAX_SIZE = 10 * 1024**3
+
+# Ways of placing an unprocessed song in the output folder:
+#  - reflink: a copy-on-write clone sharing the source's blocks (i.e. btrfs/XFS), Linux only
+#  - hardlink: another name for the source file, only possible on the same filesystem
+#  - copy_file_range: a copy done entirely in the kernel, Linux only
+#  - copy: a regular copy
+PLACEMENT_STRATEGIES = ("reflink", "hardlink", "copy_file_range", "copy")
+
+# The strategies tried by default, in order. Hardlinking is opt-in: the output would be the
+# same file as the one in the iTunes library, so editing its tags (on the device or by
+# strip_semicolons()) would edit the library's original too.
+DEFAULT_PLACEMENT = ("reflink", "copy_file_range", "copy")
+
+# ioctl request number of FICLONE, from linux/fs.h
+FICLONE = 0x40049409
+
+# Ways of processing a song:
+#  - ffmpeg: a single ffmpeg command that trims, adjusts the volume and keeps tags while streaming
+#  - pydub: decodes the whole song into memory, then trims/adjusts it in Python
+TRANSCODE_ENGINES = ("ffmpeg", "pydub")
+
+def init_worker_process(log_queue, log_level):
+    """
+    Initializer for the worker processes that copy_and_process_song() runs in.
+
+    Drops any logging handlers the process started with (i.e. main.py's, set up again when
+    it's imported by a spawned process) and sends every record through `log_queue` instead,
+    so the main process can show them in the progress window.
+
+    Also makes the process kill its ffmpeg processes when it's terminated. (Windows terminates
+    processes without a signal, but ffmpeg's partial output is still never used there.)
+
+    :param log_queue: A multiprocessing Queue read by a logging.handlers.QueueListener.
+    :param log_level: The level of the main process's root logger.
+    """
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    root_logger.setLevel(log_level)
+
+    # Pool.terminate() (on cancel) sends SIGTERM; take any running ffmpeg down with this process
+    signal.signal(signal.SIGTERM, _stop_worker_process)
+
+def _stop_worker_process(signum, frame):
+    """SIGTERM handler for worker processes, see init_worker_process()."""
+    stop_ffmpeg_processes()
+    raise SystemExit(1)
+
+def copy_and_process_song(song, output_folder='tmp', cache_folder=None, placement=DEFAULT_PLACEMENT, engine="ffmpeg"):
     """
     Copy and rename the song to its persistent ID, doing extra processing if necessary.
     
     :param song: The libpytunes Song object to use for processing.
     :param output_folder: The folder to output the copied/processed song to. `/tmp` by default.
+    :param cache_folder: The folder holding the transcode cache. If None, the cache isn't used.
+    :param placement: The strategies from PLACEMENT_STRATEGIES to try, in order, when a song
+        doesn't need processing. DEFAULT_PLACEMENT, the default, never hardlinks.
+    :param engine: The name of the engine from TRANSCODE_ENGINES used to process songs.
 
     This function works with libpytunes Song objects. It will copy the song from the Song.location
     attribute, renaming it to its persistent ID and placing it in a flat folder. By default,
     this output folder is `/tmp` relative to the run location.
 
-    If the Song object is not an mp3 file or has been trimmed, the song is processed using
-    pydub and requires ffmpeg/libav.
+    If the Song object is not an mp3 file or has been trimmed, the song is processed by
+    `engine`, which requires ffmpeg (or libav, for pydub). If a cache folder is given, the
+    result is stored there and later requests with the same source file and processing
+    parameters are served from the cache instead of being processed again.
+
+    Songs that don't need processing are placed with place_file(), so they're only physically
+    copied if they can't be reflinked. If the output from a previous sync
+    still matches the source, it's left alone.
+
+    Returns "copied", "processed", "cached" or "unchanged" depending on how the output was
+    produced, or None if the source file couldn't be found.
     """
     # affirm output_folder (and any parent folders, if specified) exists, and make it if it doesn't exist
     # https://docs.python.org/3/library/pathlib.html#pathlib.Path.mkdir
@@ -71,43 +141,328 @@ def copy_and_process_song(song, output_folder='tmp'):
     # define output paths
     _, file_extension = os.path.splitext(song.location)
     output_path = os.path.join(output_folder, song.persistent_id + ".mp3")
+    needs_processing = file_extension != ".mp3" or song.start_time or song.stop_time or song.volume_adjustment
+    has_semicolons = check_for_semicolons(song)
+
+    # An output hardlinked to the original by an earlier sync is only kept if hardlinks are allowed
+    if (not needs_processing and not has_semicolons and file_matches(song.location, output_path)
+            and ("hardlink" in placement or not os.path.samefile(song.location, output_path))):
+        logger.info(f"{song.persistent_id} is already in the output folder ({output_path})")
+        return "unchanged"
+
+    # The output may be hard linked to a cache entry by an older sync, so it
+    # has to be unlinked instead of being overwritten in place
+    if os.path.isfile(output_path):
+        os.remove(output_path)
 
+    cache_path = None
     try:
-        if file_extension != ".mp3" or song.start_time or song.stop_time or song.volume_adjustment:
-            logger.info(f"{song.persistent_id} needs to be processed by pydub ({output_path})")
-            obj = AudioSegment.from_file(song.location)
-
-            if song.start_time or song.stop_time:
-                start_time = 0 if not song.start_time else song.start_time
-                stop_time = len(obj) if not song.stop_time else song.stop_time
-
-                obj = obj[start_time:stop_time]
-
-                logger.info(f"Trimmed {song.persistent_id}")
-            
-            if song.volume_adjustment:
-                # internally stored as an integer between -255 and 255
-                # but can physically be adjusted past 255
-                if song.volume_adjustment <= -255:
-                    obj = obj - 100  # essentially silent
-                    logger.warning(f"The song {song.name} has a volume adjustment value less than -255 and is silent!")
-                else:
-                    gain_factor = (song.volume_adjustment + 255)/255
-                    decibel_change = 10 * log10(gain_factor)
-                    obj = obj + decibel_change
-                    logger.info(f"Changed {song.name} gain factor by {gain_factor} ({decibel_change} dB)")
-
-            # tags parameter is used for retaining metadata
-            obj.export(output_path, format="mp3", tags=mediainfo(song.location)['TAG'])
+        if needs_processing:
+            if cache_folder:
+                Path(cache_folder).mkdir(parents=True, exist_ok=True)
+                cache_path = os.path.join(cache_folder, transcode_cache_key(song) + ".mp3")
+
+                if os.path.isfile(cache_path):
+                    logger.info(f"{song.persistent_id} was found in the transcode cache ({output_path})")
+                    # Never hardlinked: editing the output's tags in place would edit the cache entry too
+                    place_file(cache_path, output_path)
+                    # Bump the modification time, which is used as the "last used" time for eviction
+                    os.utime(cache_path)
+                    return "cached"
+
+            logger.info(f"{song.persistent_id} needs to be processed by {engine} ({output_path})")
+            if engine == "ffmpeg":
+                transcode_with_ffmpeg(song, output_path)
+            else:
+                transcode_with_pydub(song, output_path)
+            status = "processed"
         else:
-            logger.info(f"{song.persistent_id} does not need to be processed and was directly copied ({output_path})")
-            copy2(song.location, output_path)
+            # Stripping semicolons edits the output in place, which would also edit
+            # the original file through a hardlink
+            strategies = [strategy for strategy in placement if not (has_semicolons and strategy == "hardlink")]
+            strategy = place_file(song.location, output_path, strategies)
+            logger.info(f"{song.persistent_id} does not need to be processed and was directly copied "
+                        f"with {strategy} ({output_path})")
+            status = "copied"
     except FileNotFoundError as e:
         logger.error(f"Couldn't find {song.location}")
+        return None
     
-    if check_for_semicolons(song):
+    if has_semicolons:
         strip_semicolons(output_path)    
 
+    if cache_path:
+        # Place into the cache under a temporary name first, so that a concurrent
+        # process never sees a partially written cache entry
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        place_file(output_path, temp_path)
+        os.replace(temp_path, cache_path)
+
+    return status
+
+def transcode_cache_key(song):
+    """
+    Calculate the transcode cache key of a libpytunes Song object.
+
+    The key covers the source file (its size, modification time, and the first and
+    last 64 KiB of its contents) and every parameter that changes the processed output.
+    Reading only part of the file keeps a cache lookup much cheaper than a transcode.
+
+    :param song: The libpytunes Song object to use for processing.
+    """
+    sample_size = 65536
+    stat = os.stat(song.location)
+
+    key = hashlib.blake2b(digest_size=20)
+    with open(song.location, "rb") as f:
+        key.update(f.read(sample_size))
+        if stat.st_size > sample_size:
+            f.seek(-sample_size, os.SEEK_END)
+            key.update(f.read(sample_size))
+
+    key.update(f"{stat.st_size};{stat.st_mtime_ns};{song.start_time};{song.stop_time};"
+               f"{song.volume_adjustment}".encode('utf-8'))
+
+    return key.hexdigest()
+
+def volume_adjustment_db(song):
+    """
+    Get the gain in dB matching a song's volume adjustment, or None if the song should be silent.
+    """
+    # internally stored as an integer between -255 and 255
+    # but can physically be adjusted past 255
+    if song.volume_adjustment <= -255:
+        logger.warning(f"The song {song.name} has a volume adjustment value less than -255 and is silent!")
+        return None
+
+    gain_factor = (song.volume_adjustment + 255)/255
+    decibel_change = 10 * log10(gain_factor)
+    logger.info(f"Changed {song.name} gain factor by {gain_factor} ({decibel_change} dB)")
+    return decibel_change
+
+def ffmpeg_command(song, output_path, ffmpeg_path="ffmpeg"):
+    """
+    Build the ffmpeg command that processes a song in one pass.
+
+    The trim is applied while reading the input (so the skipped audio is never decoded),
+    the volume adjustment is a filter, and the source's tags are carried over.
+    """
+    command = [ffmpeg_path, "-hide_banner", "-loglevel", "error", "-y"]
+
+    # Times are stored in milliseconds; -to is relative to the start of the file when used on the input
+    if song.start_time:
+        command += ["-ss", f"{song.start_time / 1000:.3f}"]
+    if song.stop_time:
+        command += ["-to", f"{song.stop_time / 1000:.3f}"]
+
+    command += ["-i", song.location, "-map", "0:a", "-map_metadata", "0"]
+
+    if song.volume_adjustment:
+        decibel_change = volume_adjustment_db(song)
+        command += ["-af", "volume=0" if decibel_change is None else f"volume={decibel_change:.4f}dB"]
+
+    command += ["-codec:a", "libmp3lame", "-f", "mp3", output_path]
+    return command
+
+# ffmpeg processes started by this process that are still running, so they can be
+# killed by stop_ffmpeg_processes() instead of outliving a cancelled sync
+_ffmpeg_processes = set()
+_ffmpeg_processes_lock = threading.Lock()
+
+class TranscodeStopped(Exception):
+    """Raised by transcode_with_ffmpeg() when its ffmpeg process was killed by stop_ffmpeg_processes()."""
+
+def stop_ffmpeg_processes():
+    """
+    Kill every ffmpeg process started by transcode_with_ffmpeg() in this process, i.e. on cancel.
+
+    Their partial output is never renamed into place, so nothing is left behind.
+    """
+    with _ffmpeg_processes_lock:
+        for process in _ffmpeg_processes:
+            process.stopped = True
+            process.kill()
+
+def transcode_with_ffmpeg(song, output_path):
+    """
+    Process a song with a single ffmpeg command from ffmpeg_command().
+
+    Memory use doesn't depend on the length of the song, since ffmpeg streams it. Falls back
+    to transcode_with_pydub() if ffmpeg isn't on the PATH (pydub may still find libav).
+
+    ffmpeg writes to a temporary file, which only replaces `output_path` once ffmpeg
+    has succeeded. Raises TranscodeStopped if ffmpeg is killed by stop_ffmpeg_processes().
+    """
+    ffmpeg_path = shutil.which("ffmpeg")
+    if not ffmpeg_path:
+        logger.warning("ffmpeg wasn't found on the PATH, falling back to pydub")
+        transcode_with_pydub(song, output_path)
+        return
+
+    # ffmpeg would only report this as a failed command
+    if not os.path.isfile(song.location):
+        raise FileNotFoundError(song.location)
+
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    process = subprocess.Popen(ffmpeg_command(song, temp_path, ffmpeg_path), stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    process.stopped = False
+    with _ffmpeg_processes_lock:
+        _ffmpeg_processes.add(process)
+
+    succeeded = False
+    try:
+        _, stderr = process.communicate()
+
+        if process.stopped:
+            raise TranscodeStopped(f"ffmpeg was stopped while processing {song.location}")
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to process {song.location}: {stderr.strip()}")
+
+        os.replace(temp_path, output_path)
+        succeeded = True
+    finally:
+        with _ffmpeg_processes_lock:
+            _ffmpeg_processes.discard(process)
+        # i.e. this process is being shut down while ffmpeg is still running
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        # Don't leave a partially written song behind
+        if not succeeded and os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+    if song.start_time or song.stop_time:
+        logger.info(f"Trimmed {song.persistent_id}")
+
+def transcode_with_pydub(song, output_path):
+    """
+    Process a song by decoding it into a pydub AudioSegment.
+    """
+    obj = AudioSegment.from_file(song.location)
+
+    if song.start_time or song.stop_time:
+        start_time = 0 if not song.start_time else song.start_time
+        stop_time = len(obj) if not song.stop_time else song.stop_time
+
+        obj = obj[start_time:stop_time]
+
+        logger.info(f"Trimmed {song.persistent_id}")
+    
+    if song.volume_adjustment:
+        decibel_change = volume_adjustment_db(song)
+        if decibel_change is None:
+            obj = obj - 100  # essentially silent
+        else:
+            obj = obj + decibel_change
+
+    # tags parameter is used for retaining metadata
+    obj.export(output_path, format="mp3", tags=mediainfo(song.location)['TAG'])
+
+def file_matches(source_path, output_path):
+    """
+    Check whether `output_path` is already a copy of `source_path`, going by size and modification time.
+
+    Every placement strategy keeps the modification time of the source.
+    """
+    try:
+        source_stat = os.stat(source_path)
+        output_stat = os.stat(output_path)
+    except FileNotFoundError:
+        return False
+
+    # Whole seconds, since some filesystems store modification times less precisely
+    return (source_stat.st_size == output_stat.st_size
+            and int(source_stat.st_mtime) == int(output_stat.st_mtime))
+
+def place_file(source_path, output_path, strategies=DEFAULT_PLACEMENT):
+    """
+    Make `output_path` a copy of `source_path` using the first of `strategies` that works.
+
+    Any existing file at `output_path` is replaced. Returns the strategy that was used;
+    if none of them work, the error of the last one is raised.
+
+    :param strategies: Names from PLACEMENT_STRATEGIES, in the order they should be tried.
+    """
+    if not strategies:
+        raise ValueError("No placement strategies to try")
+
+    for strategy in strategies:
+        # The output may be a hardlink to a cache entry or the source itself, so it
+        # has to be unlinked instead of being overwritten in place
+        if os.path.lexists(output_path):
+            os.remove(output_path)
+
+        try:
+            if strategy == "reflink":
+                _reflink(source_path, output_path)
+            elif strategy == "hardlink":
+                os.link(source_path, output_path)
+            elif strategy == "copy_file_range":
+                _copy_file_range(source_path, output_path)
+            elif strategy == "copy":
+                copy2(source_path, output_path)
+            else:
+                raise ValueError(f"Unknown placement strategy {strategy}")
+            return strategy
+        except FileNotFoundError:
+            # Not something another strategy can fix
+            raise
+        except (OSError, AttributeError, ImportError) as e:
+            logger.debug(f"Couldn't place {source_path} with {strategy}: {e}")
+            error = e
+
+    if os.path.lexists(output_path):
+        os.remove(output_path)
+    raise error
+
+def _reflink(source_path, output_path):
+    """Clone `source_path` to `output_path` with the FICLONE ioctl."""
+    import fcntl  # not available on Windows, which is reported as an ImportError
+
+    with open(source_path, "rb") as source, open(output_path, "wb") as output:
+        fcntl.ioctl(output.fileno(), FICLONE, source.fileno())
+    shutil.copystat(source_path, output_path)
+
+def _copy_file_range(source_path, output_path):
+    """Copy `source_path` to `output_path` within the kernel with os.copy_file_range()."""
+    with open(source_path, "rb") as source, open(output_path, "wb") as output:
+        remaining = os.fstat(source.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(source.fileno(), output.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+    shutil.copystat(source_path, output_path)
+
+def evict_transcode_cache(cache_folder, max_size=TRANSCODE_CACHE_MAX_SIZE):
+    """
+    Remove the least recently used entries of the transcode cache until it fits in `max_size` bytes.
+
+    :param cache_folder: The folder holding the transcode cache.
+    :param max_size: The maximum total size of the cache, in bytes.
+    """
+    if not os.path.isdir(cache_folder):
+        return
+
+    entries = []
+    with os.scandir(cache_folder) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(".mp3"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in entries)
+
+    # Oldest (least recently used) entries first
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= max_size:
+            break
+        os.remove(path)
+        total_size -= size
+        logger.info(f"Evicted {path} from the transcode cache")
+
 def strip_semicolons(song_path):
     """
     Replace semicolons in specific ID3 tags in the specified song path.
@@ -135,23 +490,150 @@ def check_for_semicolons(song):
             return True
     return False
 
-def add_to_bpstat(song, bpstat_prefix, bpstat_path):
+# Map of ExportImport tagName to libpytunes Song attributes
+EXPORTIMPORT_ATTRS = {
+    "Location": "location",
+    "DateAdded": "date_added",
+    "Name": "name",
+    "Album": "album",
+    "SortAlbum": "sort_album",
+    "AlbumArtist": "album_artist",
+    "Artist": "artist",
+    "Composer": "composer",
+    "Grouping": "grouping",
+    "Genre": "genre",
+    "Compilation": "compilation",
+    "DiscNumber": "disc_number",
+    "DiscCount": "disc_count",
+    "TrackNumber": "track_number",
+    "TrackCount": "track_count",
+    "Year": "year",
+    "Plays": "play_count",
+    "Played": "lastplayed",
+    "Skips": "skip_count",
+    "Skipped": "skip_date",
+    "Comment": "comments",
+    "BitRate": "bit_rate",
+    "KindAsString": "kind",
+    "BPM": "bpm",
+    "EQ": "equalizer",
+    "VA": "volume_adjustment",
+    "Start": "start_time",
+    "Finish": "stop_time",
+}
+
+def compile_exportimport_formatters(selected_fields):
     """
-    Append a song to a line in the specified .bpstat.
-    
-    :param song: The libpytunes Song object to use for processing.
-    :param bpstat_prefix: The folder used within the .bpstat for its filepath field.
-    :param bpstat_path: The full location of the .bpstat itself.
+    Turn a list of ExportImport field names into a tuple of formatter functions.
+
+    Each formatter takes a libpytunes Song object and returns that field's complete
+    line, i.e. `<Field>value\n`. All lookups and per-field special cases are resolved
+    here, once, rather than for every field of every song.
+
+    Unknown field names are logged and skipped.
+
+    :param selected_fields: A list of strings with the field names.
+    """
+    formatters = []
+    for field in selected_fields:
+        try:
+            attr_name = EXPORTIMPORT_ATTRS[field]
+        except KeyError:
+            logger.error(f"Tried to look up {field}, but it doesn't exist in the available fields; skipping")
+            continue
+
+        formatters.append(_exportimport_formatter(field, attr_name))
+
+    return tuple(formatters)
+
+def _exportimport_formatter(field, attr_name):
+    """Build the formatter for a single ExportImport field. See compile_exportimport_formatters()."""
+    get_value = attrgetter(attr_name)
+
+    # Special processing for specific fields
+    if attr_name in ["date_added", "skip_date", "lastplayed"]:
+        # If no date is set, then default to "12:00:00 AM"
+        # If a date is set, convert it to the format 1/6/2022 5:32:11 PM
+        # Unfortunately platform support for no-padding is implementation-dependent,
+        # so it's not exact
+        def formatter(song):
+            field_value = get_value(song)
+            if field_value is None:
+                return f"<{field}>12:00:00 AM\n"
+            return f"<{field}>{time.strftime('%m/%d/%Y %I:%M:%S %p', field_value)}\n"
+    elif attr_name in ["play_count", "skip_count"]:
+        # If no playcount or skipcount field exists, that's equivalent
+        # to 0 playcount/skipcount
+        def formatter(song):
+            field_value = get_value(song)
+            return f"<{field}>{field_value if field_value is not None else 0}\n"
+    elif attr_name == "start_time":
+        # The result is always rounded down to an integer (regardless of what
+        # the actual value in msec is).
+        #
+        # If no start time has been set, 0 is printed out.
+        def formatter(song):
+            field_value = get_value(song)
+            return f"<{field}>{field_value // 100 if field_value is not None else 0}\n"
+    elif attr_name == "stop_time":
+        # If no stop time has been set, the length of the song in seconds is printed out.
+        def formatter(song):
+            field_value = get_value(song)
+            if field_value is None:
+                field_value = song.total_time
+            return f"<{field}>{field_value // 100}\n"
+    else:
+        def formatter(song):
+            field_value = get_value(song)
+            return f"<{field}>{field_value if field_value is not None else ''}\n"
+
+    return formatter
+
+class ExportImportWriter:
+    """
+    Streaming writer for ExportImport files, meant to be used as a context manager:
+
+        with ExportImportWriter(output_path, ["Plays"]) as writer:
+            writer.write(song)
+
+    The file is overwritten and written through a single buffered handle.
+    ExportImport files are in utf-16 (with a BOM), *not* utf-8.
+
+    :param output_path: The full location of the txt file to use.
+    :param selected_fields: A list of strings with the field names.
     """
-    bpsong = bpparse.BPSong.from_song(song)
-    output = bpsong.as_bpstat_line(bpstat_prefix) + "\n"
 
-    with open(bpstat_path, "ab") as fp:
-        fp.write(output.encode('utf-8'))
+    def __init__(self, output_path, selected_fields):
+        self.output_path = output_path
+        self.formatters = compile_exportimport_formatters(selected_fields)
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.output_path, "w", encoding="utf-16", buffering=1024 * 1024)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+        return False
+
+    def write(self, song):
+        """Write the selected fields of a libpytunes Song object."""
+        persistent_id = song.persistent_id
+        lines = [f"<ID>{persistent_id[0:8]}-{persistent_id[8:16]}\n"]
+        lines.extend(formatter(song) for formatter in self.formatters)
+        # Separating newline
+        lines.append("\n")
+
+        self.file.write("".join(lines))
+
+    def write_all(self, songs):
+        """Write every libpytunes Song object from an iterable."""
+        for song in songs:
+            self.write(song)
 
 def add_to_exportimport(lib, selected_fields, output_path):
     """
-    Append a song to a line in the specified text file.
+    Write every song in a library to the specified text file.
 
     For use with https://samsoft.org.uk/iTunes/scripts.asp#ExportImport.
     
@@ -159,99 +641,10 @@ def add_to_exportimport(lib, selected_fields, output_path):
     :param selected_fields: A list of strings with the field names.
     :param output_path: The full location of the txt file to use.
     """
-    # Map of tagName to libpysong attributes, used with getattr
-    attrs = {
-        "Location": "location",
-        "DateAdded": "date_added",
-        "Name": "name",
-        "Album": "album",
-        "SortAlbum": "sort_album",
-        "AlbumArtist": "album_artist",
-        "Artist": "artist",
-        "Composer": "composer",
-        "Grouping": "grouping",
-        "Genre": "genre",
-        "Compilation": "compilation",
-        "DiscNumber": "disc_number",
-        "DiscCount": "disc_count",
-        "TrackNumber": "track_number",
-        "TrackCount": "track_count",
-        "Year": "year",
-        "Plays": "play_count",
-        "Played": "lastplayed",
-        "Skips": "skip_count",
-        "Skipped": "skip_date",
-        "Comment": "comments",
-        "BitRate": "bit_rate",
-        "KindAsString": "kind",
-        "BPM": "bpm",
-        "EQ": "equalizer",
-        "VA": "volume_adjustment",
-        "Start": "start_time",
-        "Finish": "stop_time",
-    }
-
     logger.info(f"Attempting write of ExportImport file with fields {selected_fields}")
 
-    # Overwrite the file if needed
-    with open(output_path, "w", encoding="utf-16") as fp:
-        fp.write("")
-
-    # This adds the BOM if needed
-    # ExportImport files are in utf-16, *not* utf-8
-    with open(output_path, "a", encoding="utf-16") as fp:
-        for _, song in lib.songs.items():
-            fp.write(f"<ID>{song.persistent_id[0:8]}-{song.persistent_id[8:16]}\n")
-            
-            for field in selected_fields:
-                try:
-                    attr_name = attrs[field]
-                except KeyError:
-                    logger.error(f"Tried to look up {field}, but it doesn't exist in the available fields; skipping")
-                    continue
-            
-                try:
-                    field_value = getattr(song, attr_name)
-                except AttributeError:
-                    logger.error(f"Song object doesn't have attribute {attr_name}? (programming error)")
-                    continue
-
-                # Special processing for specific fields
-                if attr_name in ["date_added", "skip_date", "lastplayed"]:
-                    # If no date is set, then default to "12:00:00 AM"
-                    if field_value == None:
-                        field_value = "12:00:00 AM"
-                    else:
-                        # If a date is set, convert it to the format 1/6/2022 5:32:11 PM
-                        # Unfortunately platform support for no-padding is implementation-dependent,
-                        # so it's not exact
-                        field_value = time.strftime("%m/%d/%Y %I:%M:%S %p", field_value)
-                elif attr_name in ["play_count", "skip_count"]:
-                    # If no playcount or skipcount field exists, that's equivalent
-                    # to 0 playcount/skipcount
-                    if field_value == None:
-                        field_value = 0
-                elif attr_name in ["start_time", "stop_time"]:
-                    # The result is always rounded down to an integer (regardless of what
-                    # the actual value in msec is).
-                    #
-                    # If no stop or start time has been set, either 0 (for start time)
-                    # or the length of the song in seconds (for stop time) is printed out.
-                    if field_value == None:
-                        if attr_name == "start_time":
-                            field_value = 0
-                        else:
-                            field_value = song.total_time // 100
-                    else:
-                        field_value = field_value // 100
-                else:
-                    if field_value == None:
-                        field_value = ""
-
-                fp.write(f"<{field}>{field_value}\n")
-
-            # Separating newline
-            fp.write("\n")
+    with ExportImportWriter(output_path, selected_fields) as writer:
+        writer.write_all(lib.songs.values())
 
     logger.info(f"ExportImport write complete")
 
@@ -259,7 +652,7 @@ def add_to_exportimport(lib, selected_fields, output_path):
 
 def create_backup(file_path, output_folder='backups'):
     """
-    Creates a backup of the specified file, usually a bpstat or XML.
+    Creates a backup of the specified file, usually a bpstat, XML or the database.
 
     :param file_path: The full location of the file to backup.
     :param output_folder: :param output_folder: The folder to output the copied/processed song to. `/backups` by default.
@@ -275,21 +668,116 @@ def create_backup(file_path, output_folder='backups'):
     
     out_path = os.path.join(output_folder, file_name)
 
-    copy2(file_path, out_path)
+    # the database can't just be copied, since part of it may still be in its WAL
+    if models.database_path is not None and os.path.abspath(file_path) == models.database_path:
+        models.backup_database(out_path)
+    else:
+        copy2(file_path, out_path)
 
 # region Utility
 
+# Name of the folder in the data directory holding pickled snapshots of parsed iTunes XMLs
+LIBRARY_CACHE_FOLDER_NAME = "library_cache"
+
+def library_snapshot_key(xml_path):
+    """
+    Calculate the key identifying the current contents of an iTunes XML.
+
+    The key covers the XML's absolute path, size, modification time and its first MiB.
+    Raises FileNotFoundError if the XML doesn't exist.
+    """
+    stat = os.stat(xml_path)
+
+    key = hashlib.blake2b(digest_size=20)
+    key.update(f"{os.path.abspath(xml_path)};{stat.st_size};{stat.st_mtime_ns}".encode('utf-8'))
+    with open(xml_path, "rb") as f:
+        key.update(f.read(1024 * 1024))
+
+    return key.hexdigest()
+
+def load_library(xml_path, cache_folder=None):
+    """
+    Load a libpytunes Library from an iTunes XML, reusing a parsed snapshot where possible.
+
+    Parsing a large XML with libpytunes is slow, so the parsed Library is pickled to
+    `cache_folder` and reloaded from there as long as the XML hasn't changed (see
+    library_snapshot_key()). Writing the snapshot is best-effort; if it fails, the
+    parsed library is still returned.
+
+    Raises the same exceptions as libpytunes.Library, i.e. FileNotFoundError or
+    xml.parsers.expat.ExpatError.
+
+    :param xml_path: Path to an exported XML.
+    :param cache_folder: The folder to store snapshots in, normally LIBRARY_CACHE_FOLDER_NAME
+        in the data directory. If None, the XML is always parsed.
+    """
+    if cache_folder is None:
+        return libpytunes.Library(xml_path)
+
+    key = library_snapshot_key(xml_path)
+
+    # One snapshot file per XML path; its first line holds the key it was made from
+    path_digest = hashlib.blake2b(os.path.abspath(xml_path).encode('utf-8'), digest_size=20).hexdigest()
+    snapshot_path = os.path.join(cache_folder, f"{path_digest}.pickle")
+
+    try:
+        with open(snapshot_path, "rb") as f:
+            if f.readline().rstrip(b"\n") == key.encode('utf-8'):
+                lib = pickle.load(f)
+                logger.info(f"Loaded {xml_path} from the snapshot at {snapshot_path}")
+                return lib
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Snapshot at {snapshot_path} couldn't be read, reparsing the XML ({e})")
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        logger.warning(f"Snapshot at {snapshot_path} couldn't be loaded, reparsing the XML ({e})")
+
+    lib = libpytunes.Library(xml_path)
+
+    try:
+        snapshot = pickle.dumps(lib, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError) as e:
+        logger.warning(f"Couldn't create a snapshot of {xml_path} ({e})")
+        return lib
+
+    temp_path = f"{snapshot_path}.tmp"
+    try:
+        os.makedirs(cache_folder, exist_ok=True)
+        with open(temp_path, "wb") as f:
+            f.write(key.encode('utf-8') + b"\n")
+            f.write(snapshot)
+        os.replace(temp_path, snapshot_path)
+    except OSError as e:
+        logger.warning(f"Couldn't save a snapshot of {xml_path} to {snapshot_path} ({e})")
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return lib
+
+    logger.info(f"Saved a snapshot of {xml_path} to {snapshot_path}")
+
+    return lib
+
 def first_sync_array_from_libpysongs(songs):
     """
     Creates a 2D array suitable for use with the SongView in the first-time sync window.
 
-    :param lib: A dict of libpytunes Song objects, with the track ID as keys.
+    :param lib: A dict of libpytunes Song objects (or itunesxml.TrackRecord objects), with the track ID as keys.
 
     Assumes copying and tracking should be enabled.
     """
     headers = ["Track ID", "Copy?", "Track?", "Title", "Artist", "Album", "Plays", "Trimmed?", "Volume%", "Filepath"]
 
-    data = []
+    return list(iter_first_sync_rows(songs))
+
+def iter_first_sync_rows(songs):
+    """
+    Generator version of first_sync_array_from_libpysongs(), yielding one row at a time.
+
+    Intended for SongView.set_data(), which then fetches the rows lazily.
+    """
     for track_id, song in songs.items():
         play_count = song.play_count if song.play_count else 0
         trimmed = bool(song.start_time or song.stop_time)
@@ -298,17 +786,218 @@ def first_sync_array_from_libpysongs(songs):
             gain_factor = ((song.volume_adjustment + 255)/255)
             volume = gain_factor*100
         
-        data.append([track_id, 1, 1, song.name, song.artist, song.album, play_count, trimmed, volume, song.location])
+        yield [track_id, 1, 1, song.name, song.artist, song.album, play_count, trimmed, volume, song.location]
+
+# Name of the file in the data directory holding the fingerprints of the last synced library
+FINGERPRINTS_FILENAME = "fingerprints.bin"
+
+# Fields covered by a song's fingerprint: everything that decides whether it needs
+# reprocessing, plus its playcount and the XML's record of its file changing
+FINGERPRINT_FIELDS = models.REPROCESSING_FIELDS + ("play_count", "size", "date_modified")
+
+def song_fingerprint(song):
+    """
+    Calculate the 8-byte fingerprint of a libpytunes Song object from FINGERPRINT_FIELDS.
+    """
+    values = tuple(getattr(song, field_name, None) for field_name in FINGERPRINT_FIELDS)
+    return hashlib.blake2b(repr(values).encode('utf-8'), digest_size=8).digest()
+
+def save_fingerprints(songs, fingerprints_path):
+    """
+    Write the fingerprints of the given libpytunes Song objects, replacing any existing file.
 
-    return data
+    Each entry is the 16-character persistent ID followed by the 8-byte fingerprint.
 
-def standard_sync_arrays_from_data(library, bpstat_songs, calculate_file_hashes):
+    :param songs: An iterable of libpytunes Song objects that were just synced.
+    :param fingerprints_path: The full location of the fingerprints file.
+    """
+    entries = bytearray()
+    for song in songs:
+        persistent_id = song.persistent_id.encode('ascii')
+        if len(persistent_id) != 16:
+            logger.warning(f"Not fingerprinting {song.persistent_id}, which isn't a 16-character persistent ID")
+            continue
+        entries += persistent_id + song_fingerprint(song)
+
+    temp_path = f"{fingerprints_path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(entries)
+    os.replace(temp_path, fingerprints_path)
+
+    logger.info(f"Saved {len(entries) // 24} song fingerprints to {fingerprints_path}")
+
+def load_fingerprints(fingerprints_path):
+    """
+    Read a fingerprints file written by save_fingerprints().
+
+    Returns a dict of persistent IDs to fingerprints, which is empty if the file doesn't exist.
+    """
+    try:
+        with open(fingerprints_path, "rb") as f:
+            entries = f.read()
+    except FileNotFoundError:
+        return {}
+
+    return {entries[i:i + 16].decode('ascii'): entries[i + 16:i + 24]
+            for i in range(0, len(entries) - len(entries) % 24, 24)}
+
+def classify_songs(library, fingerprints):
+    """
+    Compare a library against the fingerprints of the last sync in a single pass.
+
+    :param library: A dictionary of track IDs to libpytunes Song objects.
+    :param fingerprints: A dict returned by load_fingerprints().
+
+    Returns four sets of persistent IDs: unchanged, changed, new and removed songs.
+    """
+    unchanged = set()
+    changed = set()
+    new = set()
+
+    for song in library.values():
+        previous = fingerprints.get(song.persistent_id)
+        if previous is None:
+            new.add(song.persistent_id)
+        elif previous == song_fingerprint(song):
+            unchanged.add(song.persistent_id)
+        else:
+            changed.add(song.persistent_id)
+
+    removed = fingerprints.keys() - unchanged - changed
+
+    logger.info(f"Compared against the last sync: {len(unchanged)} unchanged, {len(changed)} changed, "
+                f"{len(new)} new, {len(removed)} removed")
+
+    return unchanged, changed, new, removed
+
+# Name of the file in the data directory recording the progress of an unfinished sync
+SYNC_JOURNAL_FILENAME = "sync_journal.txt"
+
+def sync_job_key(tracking_ids, processing_ids, mp3_target_directory, bpstat_prefix):
+    """
+    Identify a sync by everything that decides what it writes, so a journal is only
+    resumed by the same sync.
+
+    :param tracking_ids: The persistent IDs of the songs to track.
+    :param processing_ids: The persistent IDs of the songs to copy/process.
+    """
+    key = hashlib.blake2b(digest_size=16)
+    for part in (sorted(tracking_ids), sorted(processing_ids), os.path.abspath(mp3_target_directory), bpstat_prefix):
+        key.update(repr(part).encode('utf-8'))
+    return key.hexdigest()
+
+class SyncJournal:
+    """
+    Append-only record of the work finished by a sync, so a cancelled or crashed sync can be resumed.
+
+    The first line holds the job key (from sync_job_key()) and the root name of the sync's files.
+    Every line after that is `<phase> <persistent ID>`, where the phase is "bpstat" or "processing".
+    Lines are flushed as they're written; a line cut off by a crash is ignored and overwritten.
+
+    :param journal_path: The full location of the journal file.
+    :param job_key: The key of the sync about to run.
+    """
+    PHASES = ("bpstat", "processing")
+
+    def __init__(self, journal_path, job_key):
+        self.journal_path = journal_path
+        self.job_key = job_key
+
+        # Set if an existing journal for this job was loaded
+        self.root_name = None
+        self.completed = {phase: set() for phase in self.PHASES}
+
+        self._valid_length = 0
+        self._file = None
+        # Phases may be recorded from different threads
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Read the existing journal, if it belongs to this job.
+
+        Returns True if there is unfinished work to resume.
+        """
+        try:
+            with open(self.journal_path, "rb") as f:
+                contents = f.read()
+        except FileNotFoundError:
+            return False
+
+        # Anything after the last newline was cut off mid-write
+        self._valid_length = contents.rfind(b"\n") + 1
+        lines = contents[:self._valid_length].decode('utf-8').splitlines()
+        if not lines:
+            return False
+
+        job_key, _, root_name = lines[0].partition("\t")
+        if job_key != self.job_key:
+            logger.info(f"Found a journal for a different sync in {self.journal_path}, starting over")
+            return False
+
+        for line in lines[1:]:
+            phase, _, persistent_id = line.partition(" ")
+            if phase in self.completed:
+                self.completed[phase].add(persistent_id)
+
+        self.root_name = root_name
+        return True
+
+    def begin(self, root_name):
+        """
+        Open the journal for writing, continuing the loaded journal or replacing any other one.
+
+        :param root_name: The root name of this sync's files, if it isn't being resumed.
+        """
+        if self.root_name is None:
+            self.root_name = root_name
+            self._file = open(self.journal_path, "w", encoding='utf-8')
+            self._file.write(f"{self.job_key}\t{root_name}\n")
+            self._file.flush()
+        else:
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(self._valid_length)
+            self._file = open(self.journal_path, "a", encoding='utf-8')
+
+    def record(self, phase, persistent_ids):
+        """Mark the songs with the given persistent IDs as done for a phase."""
+        persistent_ids = list(persistent_ids)
+        if not persistent_ids:
+            return
+        with self._lock:
+            self._file.writelines(f"{phase} {persistent_id}\n" for persistent_id in persistent_ids)
+            self._file.flush()
+            self.completed[phase].update(persistent_ids)
+
+    def close(self):
+        """Close the journal, keeping it so the sync can be resumed."""
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        """Close and delete the journal once the sync has completely finished."""
+        self.close()
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+
+def standard_sync_arrays_from_data(library, bpstat_songs, calculate_file_hashes, hash_progress_callback=None, fingerprints=None,
+                                   stored_songs=None, ignored_ids=None):
     """
     Creates the two 2D arrays used to create the standard sync tables.
 
     :param library: A dictionary of track IDs to libpytunes Song objects.
-    :param bpstat_songs: A list of BPSong objects.
+    :param bpstat_songs: A bpparse.BPSongCollection.
     :param calculate_file_hashes: Whether to calculate file hashes (a long operation) to determine if reprocessing is needed.
+    :param hash_progress_callback: Passed to models.FileHashCache.prefetch() when file hashes are calculated.
+    :param fingerprints: Optionally, the fingerprints of the last sync from load_fingerprints().
+        Unless file hashes are calculated, songs that haven't changed since then are never
+        checked for reprocessing.
+    :param stored_songs: Optionally, a dict of persistent IDs to every StoredSong, if they've already
+        been loaded. Read from the database if not given.
+    :param ignored_ids: Optionally, a set of every ignored persistent ID. Read from the database if not given.
 
     Occurs in about four steps, two of which are done in the UI function:
     - Start by trying to load/open all three files. Raise RuntimeError (or another exception) if fail.
@@ -327,66 +1016,88 @@ def standard_sync_arrays_from_data(library, bpstat_songs, calculate_file_hashes)
     - Call first_sync_array_from_libpysongs() to create the second table's rows.
     """
     # this function can only possibly be called after the database has been initialized
-    if models.Session:
-        session = models.Session() 
-    else:
+    if not models.Session:
         logger.error("Attempted call to make standard sync array when session hadn't been established yet.")
         raise AssertionError()
 
-    # create dict for bpstat songs, by persistent id
-    bpsongs = {}
-    for bpsong in bpstat_songs:
-        bpsongs[bpsong.get_persistent_id()] = bpsong
+    # Load every tracked and ignored song up front in (at most) two bulk reads, instead of
+    # querying the database once (or twice) for every song in the library.
+    # Everything below is then a dictionary/set lookup by persistent ID.
+    with models.Session() as session:
+        if stored_songs is None:
+            stored_songs = {stored_song.persistent_id: stored_song
+                            for stored_song in session.query(models.StoredSong)}
+        if ignored_ids is None:
+            ignored_ids = {persistent_id
+                           for persistent_id, in session.query(models.IgnoredSong.persistent_id)}
+
+    # bpstat songs, by persistent id
+    bpsongs = bpstat_songs.by_persistent_id
+
+    # Songs identical to how they were at the last sync can't need reprocessing, so they skip
+    # the checks below. The fingerprint only covers what the XML says, so a file retagged or
+    # replaced outside of iTunes is only caught by its hash - when hashes are calculated, every
+    # tracked song is still checked. (FileHashCache only rehashes files that changed on disk.)
+    unchanged_ids = set()
+    if fingerprints and not calculate_file_hashes:
+        unchanged_ids, _, _, _ = classify_songs(library, fingerprints)
+
+    # Hash every tracked song's file up front, concurrently, so that
+    # needs_reprocessing() below only has to look the hashes up
+    if calculate_file_hashes:
+        tracked_paths = [song.location for song in library.values()
+                         if song.persistent_id in stored_songs and song.location]
+        models.file_hash_cache.prefetch(tracked_paths, progress_callback=hash_progress_callback)
 
     # start checking in both
     new_songs = {}
-    existing_songs_rows = []
+    tracked_songs = []  # (track_id, song, stored_song, bpstat_song)
     for track_id, song in library.items():
         # check if the song exists in both the bpstat and the database
-        try:
-            stored_song = session.query(models.StoredSong).filter(models.StoredSong.persistent_id==song.persistent_id).scalar()
-            bpstat_song = bpsongs[song.persistent_id]
+        stored_song = stored_songs.get(song.persistent_id)
+        bpstat_song = bpsongs.get(song.persistent_id)
 
-            if not stored_song:
-                raise KeyError()  # same behavior as bpstat_song throwing a KeyError upon no result found
-        except sqlalchemy.orm.exc.MultipleResultsFound:
-            logger.error("Database has multiple entries of the same ID?")
-            continue
-        except KeyError:
+        if not stored_song or not bpstat_song:
             # The song doesn't exist in the StoredSong or wasn't in the bpstat.
             # Check if the song was previously ignored (i.e.) a corresponding IgnoredSong entry exists.
             # If so, then do not attempt to add it to the new song table.
-            ignored_song = session.query(models.IgnoredSong).filter(
-                models.IgnoredSong.persistent_id == song.persistent_id).scalar()
-
-            if not ignored_song:
+            if song.persistent_id not in ignored_ids:
                 new_songs[track_id] = song
 
             # In all cases, since the song is not being tracked, move on to the next song.
             continue
 
         # if it gets here, then the song is being tracked
-        # note that songs are added to this table/2D array regardless of its playcount has changed or not
-        # ["Track ID", "Reprocess", "Title", "Artist", "Album", "Base plays", "XML plays", "BP plays", "Delta", "New playcount", "Persistent ID"]
+        tracked_songs.append((track_id, song, stored_song, bpstat_song))
+
+    # Check which tracked songs need reprocessing (due to a change in any qualifying field)
+    # in one pass over the whole table. Songs unchanged since the last sync (see above) aren't
+    # compared at all. calculate_file_hashes additionally compares file hashes, which is a long operation.
+    candidates = [(stored_song, song) for _, song, stored_song, _ in tracked_songs
+                  if song.persistent_id not in unchanged_ids]
+    needs_reprocessing, _ = models.batch_needs_reprocessing([stored_song for stored_song, _ in candidates],
+                                                            [song for _, song in candidates],
+                                                            calculate_file_hashes)
+    reprocess_ids = {song.persistent_id for (_, song), reprocess in zip(candidates, needs_reprocessing) if reprocess}
+
+    # note that songs are added to this table/2D array regardless of its playcount has changed or not
+    # ["Track ID", "Reprocess", "Title", "Artist", "Album", "Base plays", "XML plays", "BP plays", "Delta", "New playcount", "Persistent ID"]
+    existing_songs_rows = []
+    for track_id, song, stored_song, bpstat_song in tracked_songs:
         play_count = song.play_count if song.play_count else 0
         delta = stored_song.get_delta(play_count, bpstat_song.total_plays)
         
         # Default to not drawing checkbox by default. -1 indicates "no checkbox"
-        # to the underlying widgets. 
-        reprocess = -1
-        if stored_song.needs_reprocessing(song, calculate_file_hashes):
-            # This StoredSong method takes in a libpytunes Song object and compares the
-            # relevant fields to see if reprocessing is needed. If it returns true,
-            # which occurs if ANY qualifying field has changed, then set the checkbox
-            # to equal 1.
-            #
-            # calculate_file_hashes is an optional argument that skips calculating file
-            # hashes, since it is a long operation.
-            reprocess = 1
+        # to the underlying widgets. If the song needs reprocessing, set the checkbox to 1.
+        reprocess = 1 if song.persistent_id in reprocess_ids else -1
         
         existing_songs_rows.append([track_id, reprocess, song.name, song.artist, song.album, stored_song.last_playcount, play_count,
                                    bpstat_song.total_plays, delta, stored_song.last_playcount+delta, song.persistent_id])
 
+    # Persist any hashes calculated by batch_needs_reprocessing()
+    if calculate_file_hashes:
+        models.file_hash_cache.save()
+
     # create data for first-time from dict
     new_songs_rows = first_sync_array_from_libpysongs(new_songs)
 
@@ -443,7 +1154,7 @@ def get_statistics(array_data, lib, tracking_column: int, processing_column: int
     These are used to look sizes up against `lib`.
 
     :param array_data: The underlying table model data.
-    :param lib: The libpytunes library represented by this data.
+    :param lib: The libpytunes library (or itunesxml.StreamingLibrary) represented by this data.
     :param tracking_column: The index of the column representing songs to track.
     :param processing_column: The index of the column representing songs to process.
     
@@ -466,10 +1177,14 @@ def get_statistics(array_data, lib, tracking_column: int, processing_column: int
     if processing_column and (processing_column < 1 or processing_column >= num_columns):
         raise RuntimeError("processing_column out of range")
 
+    # An itunesxml.StreamingLibrary's records have everything needed here,
+    # so use those instead of creating every Song
+    songs = lib.records if hasattr(lib, "records") else lib.songs
+
     for row in array_data:
         try:
             track_id = row[0]
-            song = lib.songs[track_id]
+            song = songs[track_id]
         except KeyError:
             logger.error(f"Didn't find {track_id} in the underlying library, but it was in the table?")
             continue
@@ -506,8 +1221,16 @@ def get_std_data(xml_path, bpstat_path, database_path):
     :param database_bath: Path to the program database.
     """
     # try generating the libpytunes library from specified XML
+    # the database hasn't been opened yet, so work out its data directory the same way
+    # models.initialize_engine() does. If the database doesn't exist, the path is probably
+    # wrong, so nothing is created there (connecting to it will fail below).
+    cache_folder = None
+    if os.path.isfile(database_path):
+        cache_folder = os.path.join(os.path.dirname(database_path), LIBRARY_CACHE_FOLDER_NAME)
+    elif os.path.isdir(database_path):
+        cache_folder = os.path.join(database_path, LIBRARY_CACHE_FOLDER_NAME)
     try:
-        lib = libpytunes.Library(xml_path)
+        lib = load_library(xml_path, cache_folder)
     except xml.parsers.expat.ExpatError as e:
         show_error_window("Invalid XML file!",
                             f"Couldn't parse XML file (if it is one) - {e}",
@@ -606,11 +1329,7 @@ def handle_updated_song_data(new_data, target_row, table:SongView, processing_co
             # do nothing.
             pass
 
-    # Update row in data
-    data[target_row] = new_data[0]
-
-    # Tell the model to update
-    # inefficient call?
-    table.set_data(data)
+    # Update the row in the model, which only repaints that row
+    table.table_model.replace_row(target_row, new_data[0])
 
 # endregion
\ No newline at end of file
@@ -9,13 +9,20 @@ from PySide6.QtGui import *
 from PySide6 import QtCore, QtWidgets, QtGui
 
 import datetime
+import functools
+import itertools
 import logging
+import logging.handlers
+import multiprocessing
 import os           # All for a "show in Explorer" feature
+import queue
+import threading
 import time
 
 import eyed3
 import libpytunes
 
+import bpparse
 import bpsynctools
 import models
 
@@ -180,21 +187,38 @@ class SortFilterProxyModel(QSortFilterProxyModel):
     """
     Proxy used to perform filtering and sorting without affecting the underlying data.
 
-    Expects the parent (SongView) to have the filter_on array.
+    Expects the parent (SongView) to have the filter_on array, and the source model
+    to be a SongTableModel (whose search keys are used for plain-text filters).
     """
+    # Characters that make filter text a regular expression, rather than plain text
+    REGEX_CHARACTERS = frozenset("\\^$.|?*+()[]{}")
 
     def __init__(self, *args, **kwargs):
         QSortFilterProxyModel.__init__(self, *args, **kwargs)
         # Enabling DynamicSortFilter means that editing a checkbox instantly resorts, which is jarring to the user
         self.setDynamicSortFilter(False)
 
+        # Case-folded filter text if it's plain text, else None (and the regular expression filter is used)
+        self.filter_text = ""
+
+        # Waits for typing to pause before filtering; see queue_filter_text()
+        self.filter_delay = 150  # ms
+        self.pending_filter_text = ""
+        self.filter_timer = QtCore.QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.timeout.connect(lambda: self.set_filter_text(self.pending_filter_text))
+
     def filterAcceptsRow(self, source_row, source_parent):
         """
-        Filters rows based on filterRegularExpression.
+        Filters rows based on the filter text, or filterRegularExpression if it isn't plain text.
 
         Intended signal is a textChanged from a LineEdit like so:
-        `self.LineEdit.textChanged.connect(lambda text: TableView.proxy.set_filter_text(text))`
+        `self.LineEdit.textChanged.connect(lambda text: TableView.proxy.queue_filter_text(text))`
         """
+        # Plain text is just a substring check against the row's precomputed search key
+        if self.filter_text is not None:
+            return self.filter_text in self.sourceModel().search_keys[source_row]
+
         # The proxy's current regular expression filter
         regex = self.filterRegularExpression()
 
@@ -209,12 +233,27 @@ class SortFilterProxyModel(QSortFilterProxyModel):
         return False
 
     def set_filter_text(self, text):
-        reg_exp = QtCore.QRegularExpression(text,QtCore.QRegularExpression.CaseInsensitiveOption)
-        # This implicitly runs FilterAcceptsRow()
-        self.setFilterRegularExpression(reg_exp)
+        self.filter_timer.stop()
+
+        if self.REGEX_CHARACTERS.isdisjoint(text):
+            self.filter_text = text.casefold()
+            # Rerun FilterAcceptsRow() without going through a regular expression
+            self.invalidateFilter()
+        else:
+            self.filter_text = None
+            reg_exp = QtCore.QRegularExpression(text,QtCore.QRegularExpression.CaseInsensitiveOption)
+            # This implicitly runs FilterAcceptsRow()
+            self.setFilterRegularExpression(reg_exp)
         # Fixes proxy not maintaining sorting after unfiltering
         self.sort(self.sortColumn(), self.sortOrder())
 
+    def queue_filter_text(self, text):
+        """
+        Filter on `text` once it hasn't changed for `filter_delay` ms, i.e. when typing pauses.
+        """
+        self.pending_filter_text = text
+        self.filter_timer.start(self.filter_delay)
+
 class SongTableModel(QAbstractTableModel):
     """
     Adapted from the following: 
@@ -230,17 +269,48 @@ class SongTableModel(QAbstractTableModel):
     # the value is different than it was before the setData() call.
     dataActuallyChanged = QtCore.Signal(QtCore.QModelIndex)
 
-    def __init__(self, data, headers, checkbox_columns, parent=None):
+    # Signal emitted when set_column_values() changes a checkbox column of many rows at once,
+    # instead of one dataActuallyChanged per cell.
+    # Slot: column index, list of the (source) rows that actually changed, new value
+    checkStatesChanged = QtCore.Signal(int, object, int)
+
+    def __init__(self, data, headers, checkbox_columns, parent=None, key_columns=(0,), search_columns=()):
         """
         :param data: 2D array of data
         :param headers: Array of strings.
         :param parent: Parent of model.
+        :param key_columns: Indexes of columns whose values are unique to each row (i.e. track
+            ID, persistent ID), which rows can be looked up by with find_row().
+        :param search_columns: Indexes of columns that SortFilterProxyModel searches.
         """
         QAbstractTableModel.__init__(self, parent)
         self.array_data = data
         self.header_data = headers
         self.checkbox_columns = checkbox_columns
 
+        # For each key column, a dict of values in that column to the row they're in.
+        # Sorting only happens in the proxy, so source rows never move around.
+        self.key_columns = key_columns
+        self.row_index = {}
+        self.rebuild_row_index()
+
+        # For each row, the case-folded text of its search columns, kept in sync with
+        # array_data so filtering never has to go through data() or str() again
+        self.search_columns = search_columns
+        self.search_keys = [self.search_key(row) for row in self.array_data]
+
+        # Iterator over rows that haven't been added to array_data yet (see set_rows())
+        self.pending_rows = None
+        # Number of rows added to array_data at a time while rows are pending
+        self.fetch_batch_size = 1000
+
+        # Keeps fetching pending rows whenever the event loop is idle, so that they
+        # all stream in without the view having to be scrolled to the bottom
+        self.fetch_timer = QtCore.QTimer(self)
+        self.fetch_timer.setSingleShot(True)
+        self.fetch_timer.setInterval(0)
+        self.fetch_timer.timeout.connect(self.fetch_in_background)
+
     def flags(self, index):
         """
         :param index: A QtCore.QModelIndex
@@ -257,6 +327,162 @@ class SongTableModel(QAbstractTableModel):
             # return QAbstractTableModel.flags(index)
             return Qt.ItemIsEnabled | Qt.ItemIsSelectable
 
+    def set_rows(self, rows):
+        """
+        Replace all rows of the model, resetting it.
+
+        A list is used as-is. Any other iterable (i.e. a generator over a library) is
+        consumed in batches of `fetch_batch_size`: the first batch is available immediately,
+        and the rest is added through fetchMore() in the background.
+
+        :param rows: A 2D array of table data, or an iterable of rows.
+        """
+        self.fetch_timer.stop()
+        self.beginResetModel()
+        if isinstance(rows, list):
+            self.array_data = rows
+            self.pending_rows = None
+        else:
+            self.pending_rows = iter(rows)
+            self.array_data = self.next_batch()
+        self.rebuild_row_index()
+        self.search_keys = [self.search_key(row) for row in self.array_data]
+        self.endResetModel()
+
+        if self.pending_rows is not None:
+            self.fetch_timer.start()
+
+    def next_batch(self):
+        """
+        Take the next `fetch_batch_size` rows from `pending_rows`, clearing it once it's exhausted.
+        """
+        batch = list(itertools.islice(self.pending_rows, self.fetch_batch_size))
+        if len(batch) < self.fetch_batch_size:
+            self.pending_rows = None
+        return batch
+
+    def canFetchMore(self, parent):
+        # Only the (invisible) root has children in a table
+        return not parent.isValid() and self.pending_rows is not None
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        self.append_rows(self.next_batch())
+
+    def fetch_in_background(self):
+        """
+        Fetch one batch of pending rows, then let the event loop run before fetching the next one.
+        """
+        self.fetchMore(QtCore.QModelIndex())
+        if self.pending_rows is not None:
+            self.fetch_timer.start()
+
+    def fetch_all(self):
+        """
+        Add all pending rows at once, i.e. before something needs every row of array_data.
+        """
+        if self.pending_rows is None:
+            return
+        self.fetch_timer.stop()
+        rows = list(self.pending_rows)
+        self.pending_rows = None
+        self.append_rows(rows)
+
+    def append_rows(self, rows):
+        """
+        Add rows to the end of the model, emitting rowsInserted.
+        """
+        self.insert_rows(len(self.array_data), rows)
+
+    def insert_rows(self, first_row, rows):
+        """
+        Insert rows before `first_row`, emitting only rowsInserted for them.
+
+        :param first_row: The row the first new row ends up at; len(array_data) appends.
+        :param rows: A list of rows, each with the same dimensions as the rest of the table.
+        """
+        if not rows:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), first_row, first_row + len(rows) - 1)
+        self.array_data[first_row:first_row] = rows
+        # The new rows and every row after them have moved
+        self.index_rows(first_row)
+        self.search_keys[first_row:first_row] = [self.search_key(row) for row in rows]
+        self.endInsertRows()
+
+    def remove_rows(self, first_row, count=1):
+        """
+        Remove `count` rows starting at `first_row`, emitting only rowsRemoved for them.
+        """
+        if count <= 0:
+            return
+        self.beginRemoveRows(QtCore.QModelIndex(), first_row, first_row + count - 1)
+        self.unindex_rows(first_row, first_row + count - 1)
+        del self.array_data[first_row:first_row + count]
+        del self.search_keys[first_row:first_row + count]
+        # Every row after the removed ones has moved up
+        self.index_rows(first_row)
+        self.endRemoveRows()
+
+    def replace_row(self, row_number, row):
+        """
+        Replace one row in place, emitting dataChanged for just that row.
+
+        Like set_data(), this doesn't emit dataActuallyChanged; use setData() on
+        checkbox cells if statistics need to follow the change.
+        """
+        self.unindex_rows(row_number, row_number)
+        self.array_data[row_number] = row
+        self.index_rows(row_number, row_number)
+        self.search_keys[row_number] = self.search_key(row)
+
+        self.dataChanged.emit(self.index(row_number, 0), self.index(row_number, self.columnCount(QtCore.QModelIndex()) - 1), ())
+
+    def rebuild_row_index(self):
+        """
+        Index every row of array_data from scratch, i.e. after it's been replaced.
+        """
+        self.row_index = {column: {} for column in self.key_columns}
+        self.index_rows(0)
+
+    def index_rows(self, first_row, last_row=None):
+        """
+        Add rows of array_data (from `first_row` to `last_row`, inclusive) to the row index.
+
+        :param last_row: Defaults to the last row.
+        """
+        rows = self.array_data[first_row:None if last_row is None else last_row + 1]
+        for column, column_index in self.row_index.items():
+            column_index.update((row[column], row_number) for row_number, row in enumerate(rows, first_row))
+
+    def unindex_rows(self, first_row, last_row):
+        """
+        Remove rows of array_data (from `first_row` to `last_row`, inclusive) from the row index.
+        """
+        for column, column_index in self.row_index.items():
+            for row_number in range(first_row, last_row + 1):
+                key = self.array_data[row_number][column]
+                if column_index.get(key) == row_number:
+                    del column_index[key]
+
+    def search_key(self, row):
+        """
+        Get the text SortFilterProxyModel searches for a row: its search columns, case-folded.
+
+        Columns are separated by a newline, which filter text can't contain, so matches never
+        span two columns.
+        """
+        return "\n".join(str(row[column]) for column in self.search_columns).casefold()
+
+    def find_row(self, key, column=0):
+        """
+        Get the row (in this model, not the proxy) holding `key` in one of the key columns, or -1 if there isn't one.
+
+        :param column: The key column to look `key` up in. Defaults to the track ID column.
+        """
+        return self.row_index[column].get(key, -1)
+
     def rowCount(self, parent):
         return len(self.array_data)
 
@@ -295,6 +521,8 @@ class SongTableModel(QAbstractTableModel):
         if role == Qt.EditRole and int(index.flags() & QtCore.Qt.ItemIsEditable) > 0:
             old_data = self.array_data[index.row()][index.column()]
             self.array_data[index.row()][index.column()] = value
+            if index.column() in self.search_columns:
+                self.search_keys[index.row()] = self.search_key(self.array_data[index.row()])
 
             # https://doc.qt.io/qt-6/qabstractitemmodel.html#dataChanged
             # dataChanged normally takes a top-left index, bottom-right index, and a list of flags
@@ -312,6 +540,38 @@ class SongTableModel(QAbstractTableModel):
         else:
             return False
 
+    def set_column_values(self, column, rows, value):
+        """
+        Set a checkbox column of many rows in one pass, i.e. from a header checkbox.
+
+        Rows without a checkbox (-1) are skipped. Rather than emitting dataChanged and
+        dataActuallyChanged for every cell like setData(), this emits one dataChanged
+        spanning all the changed rows and one checkStatesChanged listing them.
+
+        :param column: The index of a checkbox column.
+        :param rows: An iterable of rows (in this model, not the proxy) to set.
+        :param value: The new value of the checkboxes.
+
+        Returns the list of rows that actually changed.
+        """
+        if column not in self.checkbox_columns:
+            raise ValueError(f"Column {column} isn't a checkbox column")
+
+        changed_rows = []
+        for row_number in rows:
+            row = self.array_data[row_number]
+            if row[column] != -1 and row[column] != value:
+                row[column] = value
+                changed_rows.append(row_number)
+                if column in self.search_columns:
+                    self.search_keys[row_number] = self.search_key(row)
+
+        if changed_rows:
+            self.dataChanged.emit(self.index(min(changed_rows), column), self.index(max(changed_rows), column), ())
+            self.checkStatesChanged.emit(column, changed_rows, value)
+
+        return changed_rows
+
     '''
     # Manually called - see https://stackoverflow.com/questions/28660287/sort-qtableview-in-pyqt5
     def sort(self, Ncol, order):
@@ -330,8 +590,8 @@ class SongView(QTableView):
     """
     Custom QTableView with support for checkboxes and multi-column filtering. Call `setup()` to setup.
 
-    To filter, connect a signal to the proxy's regular expression filter, e.g.:
-    `self.LineEdit.textChanged.connect(lambda text: SongView.proxy.setFilterRegularExpression(text))`
+    To filter, connect a signal to the proxy's (debounced) filter text, e.g.:
+    `self.LineEdit.textChanged.connect(lambda text: SongView.proxy.queue_filter_text(text))`
 
     Additional defaults:
         - SelectionBehavior is QAbstractItemView.SelectRows
@@ -383,7 +643,8 @@ class SongView(QTableView):
         self.box_columns = []
         self.filter_columns = []
 
-    def setup(self, headers: list[str], box_columns: list[int], filter_columns: list[int], row_height: int = 20):
+    def setup(self, headers: list[str], box_columns: list[int], filter_columns: list[int], row_height: int = 20,
+              key_columns: tuple[int, ...] = (0,)):
         """
         Initializes the table's layout and table model.
 
@@ -396,6 +657,7 @@ class SongView(QTableView):
         :param boxes: Zero-indexed array of indices to replace with the CheckBoxDelegate.
         :param filter_on: Array of indices to sort on.
         :param row_height: Height of all rows.
+        :param key_columns: Indexes of columns with a unique value per row, for SongTableModel.find_row().
         """
         # Arguments for table
         self.headers = headers
@@ -404,7 +666,7 @@ class SongView(QTableView):
 
         # Create main (hidden) model
         data = []  # By default, have just an empty table
-        self.table_model = SongTableModel(data, self.headers, self.box_columns, self)
+        self.table_model = SongTableModel(data, self.headers, self.box_columns, self, key_columns, self.filter_columns)
 
         # Create proxy model
         self.proxy = SortFilterProxyModel(self)
@@ -443,29 +705,28 @@ class SongView(QTableView):
 
     def set_data(self, data):
         """
-        Completely change underlying data and emit layoutChanged().
+        Completely change underlying data and reset the model.
 
         This *will not* cause SongTableModel to emit dataChanged().
 
-        :param data: A 2D array of table data. Horizontal dimensions must be equivalent to `headers`.
+        :param data: A 2D array of table data, or an iterable of rows to fetch lazily (see
+            SongTableModel.set_rows()). Horizontal dimensions must be equivalent to `headers`.
         """
-        self.table_model.layoutAboutToBeChanged.emit()
-        self.table_model.array_data = data
-        self.table_model.layoutChanged.emit()
+        self.table_model.set_rows(data)
 
     def update_data_from_checkbox_header(self, column_index, new_check_state):
+        # Rows that haven't streamed in yet should be toggled too
+        self.table_model.fetch_all()
+
         # Get items currently visible in proxy
         # Map from proxy to source
         # Update applicable source rows
         visible_rows = self.proxy.rowCount()
+        source_rows = [self.proxy.mapToSource(self.proxy.index(row_index, column_index)).row()
+                       for row_index in range(visible_rows)]
 
-        for row_index in range(visible_rows):
-            proxy_index = self.proxy.index(row_index, column_index)
-            source_index = self.proxy.mapToSource(proxy_index)
-
-            # Note that setData checks for the editable flag so this won't affect 
-            # the -1 "no checkbox" rows
-            self.table_model.setData(source_index, new_check_state)
+        # Note that set_column_values skips the -1 "no checkbox" rows
+        self.table_model.set_column_values(column_index, source_rows, new_check_state)
 
     def show_context_menu(self, pos, library):
         """
@@ -571,7 +832,7 @@ class TestTable(QWidget):
         self.le = QLineEdit(self)
         flayout.addRow("Search", self.le)
         # On LineEdit change, reset the proxy's filter (which also implicitly runs FilterAcceptsRow())
-        self.le.textChanged.connect(lambda text: tv2.proxy.set_filter_text(text))
+        self.le.textChanged.connect(lambda text: tv2.proxy.queue_filter_text(text))
 
 
 class SongWorkerConnection(QtCore.QObject):
@@ -646,8 +907,12 @@ class SongWorker(QtCore.QRunnable):
      - the target directory to write newly processed/copied songs
      - the target directory to write app data (database, new XMLs, .bpstats, etc.)
      - the filepath prefix to use in the .bpstat itself
+
+    Optionally, `processes` sets the number of worker processes used to copy/process
+    songs. It defaults to the number of CPUs; a value of 1 processes songs one at a time
+    on this thread.
     """
-    def __init__(self, lib, processing_ids, tracking_ids, ignore_ids, mp3_target_directory, data_directory, bpstat_prefix):
+    def __init__(self, lib, processing_ids, tracking_ids, ignore_ids, mp3_target_directory, data_directory, bpstat_prefix, processes=None):
         super(SongWorker, self).__init__()
 
         self.lib = lib
@@ -657,11 +922,36 @@ class SongWorker(QtCore.QRunnable):
         self.mp3_target_directory = mp3_target_directory
         self.data_directory = data_directory
         self.bpstat_prefix = bpstat_prefix
+        self.processes = processes if processes else os.cpu_count() or 1
 
         self.signal_connection = SongWorkerConnection()
 
         self.root_name = datetime.datetime.now().strftime("%Y-%m-%d %H-%M-%S (new)")
         self.bpstat_path = os.path.join(self.data_directory, f"{self.root_name}.bpstat")
+        self.transcode_cache_directory = os.path.join(self.data_directory, "transcode_cache")
+        # How songs that don't need processing are placed in the output folder
+        # (hardlinking has to be opted into, see bpsynctools.DEFAULT_PLACEMENT)
+        self.placement_strategies = bpsynctools.DEFAULT_PLACEMENT
+        # What processes songs that need trimming/volume adjustment/conversion
+        self.transcode_engine = "ffmpeg"
+
+        # Whether to write to songs.db in the data directory, rather than the current database
+        self.use_data_directory_database = True
+
+        # Songs that can wait between two pipeline stages, so a fast stage can run ahead of a slow one
+        self.pipeline_queue_size = 256
+        self.stage_errors = []
+
+        # Whether to keep a checkpoint journal in the data directory, so an interrupted run can be resumed
+        self.resumable = True
+        self.journal = None
+
+        # Songs tracked by this sync, whose fingerprints are saved at the end of it
+        self.synced_songs = []
+
+        # Number of songs served from/missing the transcode cache, for the progress log
+        self.cache_hits = 0
+        self.cache_misses = 0
 
         self.stop_flag = False
 
@@ -672,60 +962,306 @@ class SongWorker(QtCore.QRunnable):
         """
         # Note: requestInterruption and isInterruptionRequested is likely better.
         self.stop_flag = True
+        # Songs processed on the worker thread itself may be waiting on ffmpeg
+        bpsynctools.stop_ffmpeg_processes()
 
     # @QtCore.Slot()
     def run(self):
         os.makedirs(self.data_directory, exist_ok=True)
         os.makedirs(self.mp3_target_directory, exist_ok=True)
-        
-        song_arr = []  # array holding libpytunes songs to add to the database for tracking
 
-        max_to_track = len(self.tracking_ids)
+        # Pick up where a cancelled/crashed run of this same sync left off
+        self.journal = None
+        if self.resumable:
+            self.journal = self.open_journal()
+        processing_done = self.journal.completed["processing"] if self.journal else set()
+
+        # Create/connect to the database first, since building rows goes through its file hash cache
+        # A standard sync has already connected to its database, which must be kept;
+        # only a first-time sync needs to create one in the data directory
+        if self.use_data_directory_database:
+            models.initialize_engine(self.data_directory)
+        # Only creates underlying tables that don't exist yet
+        models.create_db()
+
+        # The stages share no data, so they all run at once:
+        #  - songs to track go through the bpstat stage, then the database stage (on their own threads)
+        #  - songs to process go through the worker processes (on this thread)
+        # The database stage only builds rows (hashing every file along the way); they're
+        # committed in one go once every stage has finished, so a stopped sync writes nothing
+        song_arr = [self.lib.songs[track_id] for track_id in self.tracking_ids]  # libpytunes songs to track
+        stored_song_rows = []
+        database_queue = queue.Queue(maxsize=self.pipeline_queue_size)
+
+        self.stage_errors = []
+        stages = [
+            threading.Thread(target=self.run_stage, args=(self.run_bpstat_stage, song_arr, database_queue),
+                             name="bpstat stage"),
+            threading.Thread(target=self.run_stage, args=(self.run_database_stage, database_queue, stored_song_rows),
+                             name="database stage"),
+        ]
+        for stage in stages:
+            stage.start()
 
-        # bpstat generation and processing can happen at the same time
+        # If processing fails, the other stages still have to be stopped and waited for,
+        # or they'd keep going in the background after this worker is gone
+        failed = True
+        try:
+            songs = [self.lib.songs[track_id] for track_id in self.processing_ids]
+            remaining_songs = [song for song in songs if song.persistent_id not in processing_done]
+            skipped = len(songs) - len(remaining_songs)
+            if skipped:
+                logger.info(f"Skipping {skipped} songs that were already processed")
+
+            if self.processes > 1:
+                completed = self.process_songs_in_pool(remaining_songs, skipped)
+            else:
+                completed = self.process_songs_serially(remaining_songs, skipped)
+
+            logger.info(f"Transcode cache: {self.cache_hits} hits, {self.cache_misses} misses")
+            bpsynctools.evict_transcode_cache(self.transcode_cache_directory)
+            failed = False
+        finally:
+            if failed:
+                self.stop_flag = True
+            for stage in stages:
+                stage.join()
+            # Only done once the stages are done, since the bpstat stage records into the journal
+            if failed:
+                self.keep_progress()
+
+        if self.stage_errors:
+            self.keep_progress()
+            raise self.stage_errors[0]
+
+        if not completed or self.stop_flag:
+            logger.info("SongWorker thread was stopped")
+            if completed:
+                # Stopped while the other stages were still catching up
+                self.signal_connection.songStartedProcessing.emit(len(self.processing_ids), "Processing stopped - you can close this window.")
+            self.keep_progress()
+            return
 
-        # iterate only over ids to process, which is the longest task
-        for index, track_id in enumerate(self.tracking_ids):
-            # Check for thread stop
-            if self.stop_flag:
-                logger.info("SongWorker thread was stopped during bpstat generation")
-                self.signal_connection.songStartedProcessing.emit(index, f"Processing stopped - you can close this window.")
-                return
+        # Setting the progress window number progress to max disables the cancel button
+        self.signal_connection.songStartedProcessing.emit(len(self.processing_ids), f"Writing database - this may take some time")
+
+        # Write database with new songs
+        models.add_stored_song_rows(stored_song_rows)
+        models.add_ignored_ids(self.ignore_ids)
+
+        # Remember what every tracked song looked like, so the next standard sync can skip unchanged ones
+        # (kept next to the database, which is where the standard sync window loads them from)
+        self.synced_songs.extend(song_arr)
+        bpsynctools.save_fingerprints(self.synced_songs,
+                                      os.path.join(models.get_data_directory(), bpsynctools.FINGERPRINTS_FILENAME))
+
+        # Everything is written, so there's nothing left to resume
+        if self.journal:
+            self.journal.discard()
+
+        self.signal_connection.songStartedProcessing.emit(len(self.processing_ids), f"Processing complete - you can close this window.")
+
+    def run_stage(self, stage, *args):
+        """
+        Run one pipeline stage. If it fails, the other stages are stopped and run() re-raises the exception.
+        """
+        try:
+            stage(*args)
+        except Exception as e:
+            logger.exception(f"{threading.current_thread().name} failed")
+            self.stage_errors.append(e)
+            self.stop_flag = True
+
+    def run_bpstat_stage(self, songs, database_queue):
+        """
+        Write the .bpstat line of every song to track, passing each song on to the database stage.
+
+        A None is always put on the queue last, so the database stage knows to finish.
+        """
+        bpstat_done = self.journal.completed["bpstat"] if self.journal else set()
+        max_to_track = len(songs)
+        written_ids = []
+
+        try:
+            # (appending, since StandardWorker may have already written lines to this .bpstat)
+            with bpparse.BPStatWriter(self.bpstat_path, self.bpstat_prefix, append=True) as bpstat_writer:
+                for index, song in enumerate(songs):
+                    # Check for thread stop
+                    if self.stop_flag:
+                        logger.info("SongWorker thread was stopped during bpstat generation")
+                        # A journaled sync keeps the lines written so far, since it can be resumed
+                        if not self.journal:
+                            bpstat_writer.abort()
+                        break
+
+                    if song.persistent_id not in bpstat_done:
+                        logger.info(f"Added {song.name} ({song.persistent_id}) to database for tracking ({index + 1}/{max_to_track})")
+                        bpstat_writer.write(bpparse.BPSong.from_song(song))
+                        written_ids.append(song.persistent_id)
+
+                    database_queue.put(song)
+
+            # Only journaled once the writer has exited cleanly, i.e. the lines are actually in the .bpstat
+            # (if an exception was raised, the writer discarded them and we never get here)
+            if self.journal:
+                self.journal.record("bpstat", written_ids)
+        finally:
+            database_queue.put(None)
+
+    def run_database_stage(self, database_queue, rows):
+        """
+        Build the StoredSong row of every song coming out of the bpstat stage, until a None is received.
+        """
+        song = database_queue.get()
+        try:
+            while song is not None:
+                if not self.stop_flag:
+                    rows.append(models.stored_song_row(song))
+                song = database_queue.get()
+        finally:
+            # Keep draining after a stop or error, so the bpstat stage never blocks on a full queue
+            while song is not None:
+                song = database_queue.get()
+
+    def keep_progress(self):
+        """
+        Keep what a stopped or failed sync has done so far, so resuming it doesn't redo it.
+
+        Closes the journal and saves the file hashes the database stage calculated.
+        """
+        if self.journal:
+            self.journal.close()
+        try:
+            models.file_hash_cache.save()
+        except Exception:
+            # don't hide whatever stopped the sync
+            logger.exception("Couldn't save file hashes of the stopped sync")
+
+    def open_journal(self):
+        """
+        Open the checkpoint journal in the data directory, resuming it if it belongs to this sync.
+
+        When resuming, the files of the interrupted sync (i.e. its .bpstat) are reused.
+        """
+        job_key = bpsynctools.sync_job_key((self.lib.songs[track_id].persistent_id for track_id in self.tracking_ids),
+                                           (self.lib.songs[track_id].persistent_id for track_id in self.processing_ids),
+                                           self.mp3_target_directory, self.bpstat_prefix)
+        journal = bpsynctools.SyncJournal(os.path.join(self.data_directory, bpsynctools.SYNC_JOURNAL_FILENAME), job_key)
 
-            song = self.lib.songs[track_id]
+        if journal.load():
+            logger.info(f"Resuming the sync started at {journal.root_name} "
+                        f"({len(journal.completed['bpstat'])} songs tracked, {len(journal.completed['processing'])} processed)")
+            self.root_name = journal.root_name
+            self.bpstat_path = os.path.join(self.data_directory, f"{self.root_name}.bpstat")
 
-            logger.info(f"Added {song.name} ({song.persistent_id}) to database for tracking ({index + 1}/{max_to_track})")
+        journal.begin(self.root_name)
+        return journal
 
-            bpsynctools.add_to_bpstat(song, self.bpstat_prefix, self.bpstat_path)
-            song_arr.append(song)
+    def song_finished_processing(self, song, status):
+        """
+        Bookkeeping for a song returned by copy_and_process_song().
+
+        Songs that couldn't be found aren't journaled, so they're tried again on resume.
+        """
+        self.count_cache_result(status)
+        if self.journal and status:
+            self.journal.record("processing", (song.persistent_id,))
+
+    def process_songs_serially(self, songs, offset=0):
+        """
+        Copy/process each song one at a time on this thread.
 
-        for index, track_id in enumerate(self.processing_ids):
+        :param offset: The number of songs already processed, for the progress window.
+
+        Returns False if the thread was stopped before all songs were processed.
+        """
+        for index, song in enumerate(songs, offset):
             # Check for thread stop
             if self.stop_flag:
-                logger.info("SongWorker thread was stopped during song processing")
-                self.signal_connection.songStartedProcessing.emit(index, f"Processing stopped - you can close this window.")
-                return
-
-            song = self.lib.songs[track_id]
+                self.signal_connection.songStartedProcessing.emit(index, "Processing stopped - you can close this window.")
+                return False
 
             logger.info(f"Processing {song.name} ({song.persistent_id})")
             self.signal_connection.songStartedProcessing.emit(index + 1, f"{song.artist} - {song.name}")
 
-            bpsynctools.copy_and_process_song(song)
+            try:
+                status = bpsynctools.copy_and_process_song(song, self.mp3_target_directory, self.transcode_cache_directory,
+                                                           self.placement_strategies, self.transcode_engine)
+            except bpsynctools.TranscodeStopped:
+                self.signal_connection.songStartedProcessing.emit(index, "Processing stopped - you can close this window.")
+                return False
+            self.song_finished_processing(song, status)
 
-        # Setting the progress window number progress to max disables the cancel button
-        self.signal_connection.songStartedProcessing.emit(len(self.processing_ids), f"Writing database - this may take some time")
+        return True
 
-        # Create/write database with new songs
-        models.initialize_engine(self.data_directory)
-        # Only create underlying tables if the file clearly does not exist yet
-        if(not os.path.isfile(os.path.join(self.data_directory, "songs.db"))):
-            models.create_db()
+    def process_songs_in_pool(self, songs, offset=0):
+        """
+        Copy/process songs on a pool of `self.processes` worker processes.
 
-        models.add_libpy_songs(song_arr)
-        models.add_ignored_ids(self.ignore_ids)
+        Transcoding through pydub/ffmpeg is CPU-bound, so this spreads the work over
+        multiple cores. Results are collected in submission order, so the progress
+        window still counts up one song at a time.
 
-        self.signal_connection.songStartedProcessing.emit(len(self.processing_ids), f"Processing complete - you can close this window.")
+        :param offset: The number of songs already processed, for the progress window.
+
+        If the thread is stopped, the pool is terminated, which also kills any songs
+        currently being processed. Returns False in that case.
+
+        The workers are always spawned rather than forked, since forking a process running
+        Qt (and other threads) isn't safe. Their log records are sent back through a queue
+        and handled by this process's handlers, i.e. shown in the progress window.
+        """
+        logger.info(f"Processing {len(songs)} songs with {self.processes} worker processes")
+        job = functools.partial(bpsynctools.copy_and_process_song, output_folder=self.mp3_target_directory,
+                                cache_folder=self.transcode_cache_directory, placement=self.placement_strategies,
+                                engine=self.transcode_engine)
+
+        context = multiprocessing.get_context("spawn")
+        root_logger = logging.getLogger()
+        log_queue = context.Queue()
+        log_listener = logging.handlers.QueueListener(log_queue, *root_logger.handlers, respect_handler_level=True)
+        log_listener.start()
+
+        try:
+            with context.Pool(self.processes, initializer=bpsynctools.init_worker_process,
+                              initargs=(log_queue, root_logger.getEffectiveLevel())) as pool:
+                results = pool.imap(job, songs)
+
+                index = 0
+                while index < len(songs):
+                    # Check for thread stop
+                    if self.stop_flag:
+                        pool.terminate()
+                        self.signal_connection.songStartedProcessing.emit(offset + index, "Processing stopped - you can close this window.")
+                        return False
+
+                    # Poll instead of blocking so that a cancel is noticed even
+                    # while a long transcode is still running
+                    try:
+                        status = results.next(timeout=0.1)
+                    except multiprocessing.TimeoutError:
+                        continue
+
+                    song = songs[index]
+                    index += 1
+                    self.song_finished_processing(song, status)
+                    logger.info(f"Processed {song.name} ({song.persistent_id})")
+                    self.signal_connection.songStartedProcessing.emit(offset + index, f"{song.artist} - {song.name}")
+        finally:
+            log_listener.stop()
+
+        return True
+
+    def count_cache_result(self, status):
+        """
+        Update the transcode cache counters from the return value of copy_and_process_song().
+
+        Songs that were directly copied never go through the cache, so they aren't counted.
+        """
+        if status == "cached":
+            self.cache_hits += 1
+        elif status == "processed":
+            self.cache_misses += 1
 
 class StandardWorker(SongWorker):
     """
@@ -746,13 +1282,18 @@ class StandardWorker(SongWorker):
     """
     # yuck lol
     # is there a better way to arrange these parameters? does a cohesive object make sense here?
-    def __init__(self, lib, processing_ids, tracking_ids, ignore_ids, mp3_target_directory, data_directory, bpstat_prefix, backup_directory, backup_paths, songs_changed_data):
-        super().__init__(lib, processing_ids, tracking_ids, ignore_ids, mp3_target_directory, data_directory, bpstat_prefix)
+    def __init__(self, lib, processing_ids, tracking_ids, ignore_ids, mp3_target_directory, data_directory, bpstat_prefix, backup_directory, backup_paths, songs_changed_data, processes=None):
+        super().__init__(lib, processing_ids, tracking_ids, ignore_ids, mp3_target_directory, data_directory, bpstat_prefix, processes)
         self.backup_directory = backup_directory
         self.backup_paths = backup_paths
         self.songs_changed_data = songs_changed_data
 
         self.exportimport_path = os.path.join(self.data_directory, f"{self.root_name} (exportimport).txt")
+        # Keep using the database the standard sync window loaded
+        self.use_data_directory_database = False
+        # The playcount updates are written before SongWorker.run() starts, so rerunning this
+        # would apply them twice; an interrupted standard sync is recalculated from scratch instead
+        self.resumable = False
 
     def run(self):
         """
@@ -769,41 +1310,49 @@ class StandardWorker(SongWorker):
             bpsynctools.create_backup(backup_filepath, self.backup_directory)
 
         # use the already-calculated values for everything
-        # ["Track ID", "Title", "Artist", "Album", "Base plays", "XML plays", "BP plays", "Delta", "New playcount", "Persistent ID"]
+        # ["Track ID", "Reprocess", "Title", "Artist", "Album", "Base plays", "XML plays", "BP plays", "Delta", "New playcount", "Persistent ID"]
         with models.Session() as session:
+            db_songs = {db_song.persistent_id: db_song for db_song in session.query(models.StoredSong)}
+
+        updated_songs = []
+        sync_events = []
+
+        # The ExportImport file carries the new playcounts back into iTunes
+        with bpparse.BPStatWriter(self.bpstat_path, self.bpstat_prefix) as bpstat_writer, \
+                bpsynctools.ExportImportWriter(self.exportimport_path, ["Plays"]) as exportimport_writer:
             # Update existing entries from the songs_changed_table
             for row in self.songs_changed_data:            
                 track_id = row[0]
-                xml_plays = row[5]
-                bp_plays = row[6]
-                persistent_id = row[9]
+                xml_plays = row[6]
+                bp_plays = row[7]
+                persistent_id = row[10]
 
                 # get database entry
-                db_song = session.query(models.StoredSong).filter(models.StoredSong.persistent_id==persistent_id).scalar()
+                db_song = db_songs[persistent_id]
                 delta = db_song.get_delta(xml_plays, bp_plays)
+                sync_events.append({"persistent_id": persistent_id, "base_playcount": db_song.last_playcount,
+                                    "xml_playcount": xml_plays, "bpstat_playcount": bp_plays, "delta": delta})
                 
-                # update library entry and database
+                # update library entry
                 # note that the library entry already includes the extra xml plays, so we just do last_playcount+delta
-                self.lib.songs[track_id].play_count = db_song.last_playcount + delta
+                song = self.lib.songs[track_id]
+                song.play_count = db_song.last_playcount + delta
                 
-                # at this point, we can use the library entry to update everything
+                # at this point, we can use the library entry to update the database
                 # since the delta is already reflected in the libpytunes song
-                db_song.update_from_libpy_song(self.lib.songs[track_id])
+                updated_songs.append(song)
+                self.synced_songs.append(song)
 
                 # write out to bpstat
-                bpsynctools.add_to_bpstat(self.lib.songs[track_id], self.bpstat_prefix, self.bpstat_path)
-                bpsynctools.add_to_exportimport(db_song, self.exportimport_path)
-
-            # Remove previously ignored songs if applicable
-            for track_id in self.tracking_ids:
-                lib_song_id = lib.songs[track_id].persistent_id
-                ignored_song = session.query(models.IgnoredSong).filter(models.IgnoredSong.persistent_id==persistent_id).scalar()
-                if ignored_song:
-                    ignored_song.delete()
-                    logger.info(f"Found {lib_song_id} in the ignored songs database; it's now being tracked, so it was removed")
-
-            # commit changes
-            session.commit()
+                bpstat_writer.write(bpparse.BPSong.from_song(song))
+                exportimport_writer.write(song)
+
+        # Write all updated entries at once
+        # (along with the sync's history, in the same transaction)
+        models.add_libpy_songs(updated_songs, sync_events)
+
+        # Remove previously ignored songs if applicable
+        models.remove_ignored_ids(self.lib.songs[track_id].persistent_id for track_id in self.tracking_ids)
 
         # Write out updated library to xml
         xml_path = os.path.join(self.data_directory, f"{self.root_name}.xml")
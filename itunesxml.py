@@ -0,0 +1,275 @@
+"""
+Streaming loader for iTunes XML libraries.
+
+libpytunes.Library parses the entire plist into memory and then builds every Song object
+before anything can be shown. StreamingLibrary instead walks the Tracks dictionary with
+expat, keeps a small TrackRecord per track (just the fields the tables need), and only
+builds a full libpytunes Song when one is actually asked for.
+"""
+
+import logging
+import plistlib
+import sys
+import time
+from collections.abc import Mapping
+from urllib.parse import unquote, urlparse
+from xml.parsers import expat
+
+import libpytunes
+
+logger = logging.getLogger(__name__)
+
+# plist keys mapped directly onto libpytunes Song attributes
+SONG_FIELDS = {
+    "Track ID": "track_id",
+    "Persistent ID": "persistent_id",
+    "Name": "name",
+    "Artist": "artist",
+    "Album Artist": "album_artist",
+    "Composer": "composer",
+    "Album": "album",
+    "Grouping": "grouping",
+    "Genre": "genre",
+    "Kind": "kind",
+    "Size": "size",
+    "Total Time": "total_time",
+    "Start Time": "start_time",
+    "Stop Time": "stop_time",
+    "Disc Number": "disc_number",
+    "Disc Count": "disc_count",
+    "Track Number": "track_number",
+    "Track Count": "track_count",
+    "Year": "year",
+    "Bit Rate": "bit_rate",
+    "Sample Rate": "sample_rate",
+    "Volume Adjustment": "volume_adjustment",
+    "Equalizer": "equalizer",
+    "Comments": "comments",
+    "Rating": "rating",
+    "Album Rating": "album_rating",
+    "Play Count": "play_count",
+    "Skip Count": "skip_count",
+    "BPM": "bpm",
+    "Sort Album": "sort_album",
+    "Work": "work",
+    "Movement Name": "movement_name",
+    "Movement Number": "movement_number",
+    "Movement Count": "movement_count",
+    "Track Type": "track_type",
+}
+
+# plist keys holding dates, which libpytunes stores as time structs
+SONG_DATE_FIELDS = {
+    "Date Modified": "date_modified",
+    "Date Added": "date_added",
+    "Play Date UTC": "lastplayed",
+    "Skip Date": "skip_date",
+}
+
+# plist keys that are flags; libpytunes sets these to whether the key is present at all
+SONG_FLAG_FIELDS = {
+    "Compilation": "compilation",
+    "Rating Computed": "rating_computed",
+    "Loved": "loved",
+    "Disliked": "disliked",
+    "Album Loved": "album_loved",
+    "Playlist Only": "playlist_only",
+    "Apple Music": "apple_music",
+    "Protected": "protected",
+    "Podcast": "podcast",
+    "Movie": "movie",
+    "Has Video": "has_video",
+}
+
+# plist keys kept in each TrackRecord, and the record attribute they're kept in.
+# The attribute names match libpytunes Song, so records can stand in for songs
+# when building table rows.
+RECORD_FIELDS = {
+    "Track ID": "track_id",
+    "Persistent ID": "persistent_id",
+    "Name": "name",
+    "Artist": "artist",
+    "Album": "album",
+    "Play Count": "play_count",
+    "Start Time": "start_time",
+    "Stop Time": "stop_time",
+    "Volume Adjustment": "volume_adjustment",
+    "Location": "location",
+    "Size": "size",
+    "Total Time": "total_time",
+}
+
+# plist value elements and how to convert their text
+VALUE_TYPES = {
+    "string": str,
+    "integer": int,
+    "real": float,
+    "date": str,
+}
+
+def location_from_url(url):
+    """Convert an XML Location (a file:// URL) to a path, the same way libpytunes does."""
+    return unquote(urlparse(url).path[1:])
+
+class TrackRecord:
+    """
+    The fields of one track needed to show it in a table, and where the rest of it is in the XML.
+    """
+    __slots__ = (*RECORD_FIELDS.values(), "start_byte", "end_byte")
+
+    def __init__(self):
+        for attr_name in self.__slots__:
+            setattr(self, attr_name, None)
+
+class LazySongs(Mapping):
+    """
+    Read-only mapping of track IDs to libpytunes Song objects, creating each Song on first access.
+
+    Created Songs are kept, so changes made to them (i.e. through SongInfoDialog) persist.
+    """
+
+    def __init__(self, library):
+        self.library = library
+        self.materialized = {}
+
+    def __getitem__(self, track_id):
+        song = self.materialized.get(track_id)
+        if song is None:
+            # Raises KeyError for unknown track IDs, like a dict
+            record = self.library.records[track_id]
+            song = self.materialized[track_id] = self.library.materialize(record)
+        return song
+
+    def __iter__(self):
+        return iter(self.library.records)
+
+    def __len__(self):
+        return len(self.library.records)
+
+    def __contains__(self, track_id):
+        return track_id in self.library.records
+
+class StreamingLibrary:
+    """
+    Alternative to libpytunes.Library that stream-parses the XML and creates Songs lazily.
+
+    `records` maps track IDs to TrackRecord objects and is filled while parsing.
+    `songs` maps track IDs to libpytunes Song objects, like libpytunes.Library.songs,
+    but only builds each Song when it's looked up.
+
+    Playlists aren't read, and this can't be written back out to XML.
+
+    Raises the same exceptions as libpytunes.Library, i.e. FileNotFoundError or
+    xml.parsers.expat.ExpatError.
+
+    :param xml_path: Path to an exported XML.
+    """
+
+    def __init__(self, xml_path):
+        self.xml_path = xml_path
+        self.records = {}
+        self.songs = LazySongs(self)
+
+        self._parse()
+        logger.info(f"Read {len(self.records)} tracks from {xml_path}")
+
+    def _parse(self):
+        """Fill self.records from the Tracks dictionary of the XML."""
+        parser = expat.ParserCreate()
+
+        # Nesting depth of <dict>s; the top-level dict is depth 1, Tracks is 2 and each track is 3
+        depth = 0
+        in_tracks = False
+        last_key = None
+        text = []
+        record = None
+
+        def start_element(name, attributes):
+            nonlocal depth, in_tracks, record
+            text.clear()
+
+            if name == "dict":
+                depth += 1
+                if depth == 2 and last_key == "Tracks":
+                    in_tracks = True
+                elif depth == 3 and in_tracks:
+                    record = TrackRecord()
+                    record.start_byte = parser.CurrentByteIndex
+            elif name == "true" and record is not None and last_key in RECORD_FIELDS:
+                setattr(record, RECORD_FIELDS[last_key], True)
+
+        def end_element(name):
+            nonlocal depth, last_key, record
+
+            if name == "key":
+                last_key = "".join(text)
+            elif name == "dict":
+                if depth == 3 and record is not None:
+                    # CurrentByteIndex is the start of this end tag
+                    record.end_byte = parser.CurrentByteIndex + len("</dict>")
+                    if record.location:
+                        record.location = location_from_url(record.location)
+                    if record.persistent_id:
+                        record.persistent_id = sys.intern(record.persistent_id)
+                    self.records[record.track_id] = record
+                    record = None
+                elif depth == 2 and in_tracks:
+                    # Everything after the Tracks dictionary is playlists, which aren't needed
+                    raise _TracksComplete()
+                depth -= 1
+            elif record is not None and name in VALUE_TYPES and last_key in RECORD_FIELDS:
+                setattr(record, RECORD_FIELDS[last_key], VALUE_TYPES[name]("".join(text)))
+
+        def character_data(data):
+            text.append(data)
+
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = character_data
+
+        with open(self.xml_path, "rb") as f:
+            try:
+                parser.ParseFile(f)
+            except _TracksComplete:
+                pass
+
+    def materialize(self, record):
+        """
+        Create the full libpytunes Song object for a TrackRecord.
+
+        Only this track's <dict> is reread from the XML and parsed.
+        """
+        with open(self.xml_path, "rb") as f:
+            f.seek(record.start_byte)
+            fragment = f.read(record.end_byte - record.start_byte)
+
+        attributes = plistlib.loads(b'<?xml version="1.0" encoding="UTF-8"?><plist version="1.0">'
+                                    + fragment + b'</plist>')
+
+        return song_from_attributes(attributes)
+
+def song_from_attributes(attributes):
+    """
+    Create a libpytunes Song object from the dictionary of one track in the XML,
+    filling in the same attributes as libpytunes.Library does.
+    """
+    song = libpytunes.Song()
+
+    for key, attr_name in SONG_FIELDS.items():
+        setattr(song, attr_name, attributes.get(key))
+
+    for key, attr_name in SONG_DATE_FIELDS.items():
+        value = attributes.get(key)
+        setattr(song, attr_name, time.strptime(str(value), "%Y-%m-%d %H:%M:%S") if value else None)
+
+    for key, attr_name in SONG_FLAG_FIELDS.items():
+        setattr(song, attr_name, key in attributes)
+
+    song.location_escaped = attributes.get("Location")
+    song.location = location_from_url(song.location_escaped) if song.location_escaped else None
+    song.length = song.total_time
+
+    return song
+
+class _TracksComplete(Exception):
+    """Raised from the expat handlers to stop parsing once all tracks have been read."""
@@ -1,15 +1,15 @@
 # Standard library
 import logging
+import multiprocessing
+import os
 import xml.parsers.expat
 import sys
 
-# Forked libpytunes
-from libpytunes import Library
-
 # Local imports
 import bpsynctools
 import bpsyncwidgets
 import bpparse
+import itunesxml
 import models
 
 logging.basicConfig(handlers=[logging.FileHandler("bpsync.log", mode='a', encoding='utf-8'),
@@ -70,7 +70,38 @@ class MainMenuWindow(QtWidgets.QWidget, Ui_MainMenuWindow):
     def open_m3u_generator(self):
         pass
 
-class FirstTimeWindow(QtWidgets.QWidget, Ui_FirstTimeWindow):
+class SyncStatisticsMixin:
+    """
+    Statistics handling shared by the sync windows.
+
+    Classes using this need `self.lib`, `self.stats`, a `stats_songs` property returning
+    the songs to look sizes up in (by track ID) and update_statistics_labels().
+    """
+    def update_stats_from_check_states(self, column, rows, new_state, table):
+        """
+        Update the top-right statistics after a header checkbox changed a whole column at once.
+
+        :param rows: The rows (in `table.table_model`) whose checkbox changed to `new_state`.
+        """
+        if not self.lib:
+            return
+
+        # Same as update_stats_from_index(), but as one aggregate change
+        sign = 1 if new_state else -1
+        if column == 1:
+            songs = self.stats_songs
+            track_ids = (table.table_model.array_data[row_number][0] for row_number in rows)
+            size = sum(songs[track_id].size for track_id in track_ids if track_id in songs)
+            self.stats.num_processing += sign * len(rows)
+            self.stats.size_processing += sign * size
+        elif column == 2:
+            self.stats.num_tracking += sign * len(rows)
+        else:
+            logger.error(f"Tried looking up column {column} for statistics updates?")
+
+        self.update_statistics_labels()
+
+class FirstTimeWindow(SyncStatisticsMixin, QtWidgets.QWidget, Ui_FirstTimeWindow):
     def __init__(self):
         super().__init__()
 
@@ -78,7 +109,7 @@ class FirstTimeWindow(QtWidgets.QWidget, Ui_FirstTimeWindow):
         self.setupUi(self)
 
         self.program_path = QtCore.QDir.currentPath()
-        self.lib = None  # libpytunes Library object
+        self.lib = None  # itunesxml StreamingLibrary object
         self.thread_manager = QtCore.QThreadPool()
         
         # Top-right statistics; all 0 at start.
@@ -101,7 +132,7 @@ class FirstTimeWindow(QtWidgets.QWidget, Ui_FirstTimeWindow):
         # for this to work
         self.table_widget.customContextMenuRequested.connect(lambda pos: self.table_widget.show_context_menu(pos, self.lib))
         self.table_widget.context_menu_enabled = True
-        self.table_filter_lineedit.textChanged.connect(lambda text: self.table_widget.proxy.set_filter_text(text))
+        self.table_filter_lineedit.textChanged.connect(lambda text: self.table_widget.proxy.queue_filter_text(text))
         self.table_widget.songChanged.connect(self.update_song_in_table_widget)
 
         # Table
@@ -121,6 +152,10 @@ class FirstTimeWindow(QtWidgets.QWidget, Ui_FirstTimeWindow):
         # Enable updates from checkbox
         # Note that this breaks if the underlying table model is changed (which shouldn't change)
         self.table_widget.table_model.dataActuallyChanged.connect(lambda idx: self.update_stats_from_index(idx, self.table_widget))
+        self.table_widget.table_model.checkStatesChanged.connect(
+            lambda column, rows, state: self.update_stats_from_check_states(column, rows, state, self.table_widget))
+        # Rows streaming into the table have to be counted as well
+        self.table_widget.table_model.rowsInserted.connect(lambda parent, first, last: self.update_stats_from_rows(first, last))
 
     def xml_open_prompt(self):
         file_name, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Open XML", self.program_path,
@@ -149,8 +184,10 @@ class FirstTimeWindow(QtWidgets.QWidget, Ui_FirstTimeWindow):
                               "No XML path defined")
             return
         # generate library from it
+        # The first-time sync table can be built from the streaming loader's compact
+        # records alone; full Song objects are only created for the songs that need them
         try:
-            self.lib = Library(xml_path)
+            self.lib = itunesxml.StreamingLibrary(xml_path)
         except xml.parsers.expat.ExpatError as e:
             bpsynctools.show_error_window("Invalid XML file!",
                               f"Couldn't parse XML file (if it is one) - {e}",
@@ -163,10 +200,11 @@ class FirstTimeWindow(QtWidgets.QWidget, Ui_FirstTimeWindow):
             return
         
         # update table from it
-        data = bpsynctools.first_sync_array_from_libpysongs(self.lib.songs)
-        self.table_widget.set_data(data)
+        # Rows are generated as the table fetches them, so the first ones show up immediately
+        self.table_widget.set_data(bpsynctools.iter_first_sync_rows(self.lib.records))
 
         # Generate initial statistics (overwrites current object)
+        # Only the first batch of rows is in the model so far; the rest is added by update_stats_from_rows()
         self.stats = bpsynctools.get_statistics(self.table_widget.table_model.array_data, self.lib, 2, 1)
 
         # Update stat labels
@@ -191,14 +229,8 @@ class FirstTimeWindow(QtWidgets.QWidget, Ui_FirstTimeWindow):
         # also at this point songview should inherit from a generic "table with 
         # checkbox" class
 
-        # Search for equivalent row in the underlying data
-        # Linear is good enough
-        data = self.table_widget.table_model.array_data
-        target_row = -1
-        for index, row in enumerate(data):
-            if row[0] == song.track_id:
-                target_row = index
-                break
+        # Look up the equivalent row in the underlying data
+        target_row = self.table_widget.table_model.find_row(song.track_id)
 
         if target_row == -1:
             logger.error(f"Tried looking up {song.track_id} in the model, but it wasn't there?")
@@ -210,6 +242,18 @@ class FirstTimeWindow(QtWidgets.QWidget, Ui_FirstTimeWindow):
 
         bpsynctools.handle_updated_song_data(new_data, target_row, self.table_widget)
 
+    def update_stats_from_rows(self, first, last):
+        """
+        Add rows newly inserted into the table (from `first` to `last`, inclusive) to the statistics.
+        """
+        if not self.lib:
+            return
+
+        rows = self.table_widget.table_model.array_data[first:last + 1]
+        self.stats += bpsynctools.get_statistics(rows, self.lib, 2, 1)
+
+        self.update_statistics_labels()
+
     def update_stats_from_index(self, index, table):
         """
         Update the top-right statistics from a checkbox tick/untick.
@@ -228,9 +272,9 @@ class FirstTimeWindow(QtWidgets.QWidget, Ui_FirstTimeWindow):
         track_id_index = table.table_model.createIndex(index.row(), 0, table)
         track_id = table.table_model.data(track_id_index, QtCore.Qt.DisplayRole)
 
-        # Look it up in the library
+        # Look it up in the library (only its size is needed, which the record has)
         try:
-            song = self.lib.songs[track_id]
+            song = self.lib.records[track_id]
         except KeyError:
             # If it doesn't exist (somehow), exit early
             logger.error(f"Couldn't find {track_id} when updating statistics?")
@@ -261,6 +305,11 @@ class FirstTimeWindow(QtWidgets.QWidget, Ui_FirstTimeWindow):
         # Update statistics labels
         self.update_statistics_labels()
     
+    @property
+    def stats_songs(self):
+        """The songs statistics are looked up in, by track ID."""
+        return self.lib.records
+
     def update_statistics_labels(self):
         """
         Update labels from self.stats. 
@@ -296,6 +345,8 @@ class FirstTimeWindow(QtWidgets.QWidget, Ui_FirstTimeWindow):
 
         # Data processing
         # Get track IDs of selected items by iterating over table widget's model data
+        # (including any rows that haven't streamed into the table yet)
+        self.table_widget.table_model.fetch_all()
         data = self.table_widget.table_model.array_data
         selected_ids_processing = []
         selected_ids_tracking = []
@@ -308,8 +359,8 @@ class FirstTimeWindow(QtWidgets.QWidget, Ui_FirstTimeWindow):
                 selected_ids_tracking.append(row[0])
             else:
                 # Add persistent ID to ignore list
-                song = self.lib.songs[row[0]]
-                ignored_ids_tracking.append(song.persistent_id)
+                record = self.lib.records[row[0]]
+                ignored_ids_tracking.append(record.persistent_id)
 
         # Create progress bar for element processing (the longest operation)
         progress_window = bpsyncwidgets.ProgressWindow(len(selected_ids_processing))
@@ -325,7 +376,7 @@ class FirstTimeWindow(QtWidgets.QWidget, Ui_FirstTimeWindow):
 
         progress_window.show()
 
-class StandardSyncWindow(QtWidgets.QWidget, Ui_StandardSyncWindow):
+class StandardSyncWindow(SyncStatisticsMixin, QtWidgets.QWidget, Ui_StandardSyncWindow):
     def __init__(self):
         super().__init__()
 
@@ -337,6 +388,7 @@ class StandardSyncWindow(QtWidgets.QWidget, Ui_StandardSyncWindow):
         self.program_path = QtCore.QDir.currentPath()
         self.lib = None  # libpytunes Library object
         self.db_songs = None  # Array of StoredSong objects from querying database
+        self.stored_songs = None  # The same StoredSong objects, by persistent ID
         self.bpsongs = None # Array of BPSong objects.
         self.thread_manager = QtCore.QThreadPool()
 
@@ -379,8 +431,8 @@ class StandardSyncWindow(QtWidgets.QWidget, Ui_StandardSyncWindow):
         self.songs_changed_table.songChanged.connect(self.update_song_in_songs_changed_table)
         self.new_songs_table.songChanged.connect(self.update_song_in_new_songs_table)
 
-        self.songs_changed_lineedit.textChanged.connect(lambda text: self.songs_changed_table.proxy.set_filter_text(text))
-        self.new_songs_lineedit.textChanged.connect(lambda text: self.new_songs_table.proxy.set_filter_text(text))        
+        self.songs_changed_lineedit.textChanged.connect(lambda text: self.songs_changed_table.proxy.queue_filter_text(text))
+        self.new_songs_lineedit.textChanged.connect(lambda text: self.new_songs_table.proxy.queue_filter_text(text))        
 
         # Synced songs table
         # In order: column headers, starting data, checkbox columns, columns to filter on with lineedit
@@ -391,7 +443,8 @@ class StandardSyncWindow(QtWidgets.QWidget, Ui_StandardSyncWindow):
 
         column_sizes_delta = [50, 120, 200, 120, 120, 80, 80, 80, 80, 100, 200]
 
-        self.songs_changed_table.setup(headers_delta, box_columns_delta, filter_on_delta)
+        # Rows can be looked up by track ID or persistent ID
+        self.songs_changed_table.setup(headers_delta, box_columns_delta, filter_on_delta, key_columns=(0, 10))
         self.songs_changed_table.set_data(data_delta)
         self.songs_changed_table.set_column_widths(column_sizes_delta)
 
@@ -411,6 +464,10 @@ class StandardSyncWindow(QtWidgets.QWidget, Ui_StandardSyncWindow):
         # Note that this breaks if the underlying table model is changed (which shouldn't change)
         self.new_songs_table.table_model.dataActuallyChanged.connect(lambda idx: self.update_stats_from_index(idx, self.new_songs_table))
         self.songs_changed_table.table_model.dataActuallyChanged.connect(lambda idx: self.update_stats_from_index(idx, self.songs_changed_table))
+        self.new_songs_table.table_model.checkStatesChanged.connect(
+            lambda column, rows, state: self.update_stats_from_check_states(column, rows, state, self.new_songs_table))
+        self.songs_changed_table.table_model.checkStatesChanged.connect(
+            lambda column, rows, state: self.update_stats_from_check_states(column, rows, state, self.songs_changed_table))
     
     def open_ignored_songs_dialog(self):
         # whose responsibility is it to keep track of this?
@@ -485,6 +542,7 @@ class StandardSyncWindow(QtWidgets.QWidget, Ui_StandardSyncWindow):
         file_data = bpsynctools.get_std_data(xml_path, bpstat_path, database_path)
         if file_data:
             self.lib, self.bpsongs, self.db_songs = file_data
+            self.stored_songs = {db_song.persistent_id: db_song for db_song in self.db_songs}
         else:
             # return early
             return
@@ -492,8 +550,26 @@ class StandardSyncWindow(QtWidgets.QWidget, Ui_StandardSyncWindow):
         # check if file hashing is needed
         calculate_hashes = self.calc_hashes_checkbox.isChecked()
 
+        # show hashing progress, since it can take a long time on large libraries
+        hash_progress_callback = None
+        if calculate_hashes:
+            progress_dialog = QtWidgets.QProgressDialog("Calculating file hashes...", None, 0, 1000, self)
+            progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+            progress_dialog.setMinimumDuration(0)
+            hash_progress_callback = lambda *progress: self.update_hash_progress(progress_dialog, *progress)
+
+        # fingerprints of the last sync, if there was one, to skip unchanged songs
+        # these are saved next to the database the last sync wrote to, which get_std_data() just opened
+        fingerprints_path = os.path.join(models.get_data_directory(), bpsynctools.FINGERPRINTS_FILENAME)
+        fingerprints = bpsynctools.load_fingerprints(fingerprints_path)
+
         # call helper function
-        existing_data, new_data = bpsynctools.standard_sync_arrays_from_data(self.lib.songs, self.bpsongs, calculate_hashes)
+        existing_data, new_data = bpsynctools.standard_sync_arrays_from_data(self.lib.songs, self.bpsongs, calculate_hashes,
+                                                                             hash_progress_callback, fingerprints,
+                                                                             stored_songs=self.stored_songs)
+
+        if calculate_hashes:
+            progress_dialog.close()
 
         self.songs_changed_table.set_data(existing_data)
         self.new_songs_table.set_data(new_data)
@@ -510,6 +586,20 @@ class StandardSyncWindow(QtWidgets.QWidget, Ui_StandardSyncWindow):
         # Update stat labels
         self.update_statistics_labels()
 
+    def update_hash_progress(self, progress_dialog, files_done, total_files, bytes_done, total_bytes):
+        """
+        Update the file hashing progress dialog. Used as the progress callback for hashing.
+
+        Progress is tracked by bytes (scaled to 0-1000, since a library can be larger
+        than what a QProgressDialog's int range can hold) and shown by file.
+        """
+        progress_dialog.setLabelText(f"Calculating file hashes ({files_done}/{total_files} files, "
+                                     f"{bpsynctools.humanbytes(bytes_done)} of {bpsynctools.humanbytes(total_bytes)})")
+        progress_dialog.setValue(bytes_done * 1000 // total_bytes if total_bytes else 1000)
+
+        # The hashing runs on the UI thread's behalf, so keep the window responsive
+        QtWidgets.QApplication.processEvents()
+
     def update_song_in_songs_changed_table(self, song):
         """
         Called when a Song object in self.lib is modified by any means.
@@ -517,22 +607,20 @@ class StandardSyncWindow(QtWidgets.QWidget, Ui_StandardSyncWindow):
         It is this window's responsibility to know how to handle the change
         of a song object in the underlying library.
         """
-        # Search for equivalent row in the underlying data
-        # Linear is good enough
-        data = self.songs_changed_table.table_model.array_data
-        target_row = -1
-        for index, row in enumerate(data):
-            if row[0] == song.track_id:
-                target_row = index
-                break
+        # Look up the equivalent row in the underlying data
+        target_row = self.songs_changed_table.table_model.find_row(song.track_id)
 
         if target_row == -1:
             logger.error(f"Tried looking up {song.track_id} in the model, but it wasn't there?")
             return
 
         # Generate a "fake" first_sync_array from the song
+        # Reuses the StoredSongs loaded with the window instead of reading the whole table again.
+        # The song is in the songs changed table, so it's tracked and whether it's ignored doesn't matter.
         temp_lib = {song.track_id: song}
-        existing_songs_rows, _ = bpsynctools.standard_sync_arrays_from_data(temp_lib, self.bpsongs, False) # don't calc hashes
+        existing_songs_rows, _ = bpsynctools.standard_sync_arrays_from_data(temp_lib, self.bpsongs, False, # don't calc hashes
+                                                                            stored_songs=self.stored_songs,
+                                                                            ignored_ids=set())
 
         bpsynctools.handle_updated_song_data(existing_songs_rows, target_row, self.songs_changed_table)
 
@@ -543,14 +631,8 @@ class StandardSyncWindow(QtWidgets.QWidget, Ui_StandardSyncWindow):
         It is this window's responsibility to know how to handle the change
         of a song object in the underlying library.
         """
-        # Search for equivalent row in the underlying data
-        # Linear is good enough
-        data = self.new_songs_table.table_model.array_data
-        target_row = -1
-        for index, row in enumerate(data):
-            if row[0] == song.track_id:
-                target_row = index
-                break
+        # Look up the equivalent row in the underlying data
+        target_row = self.new_songs_table.table_model.find_row(song.track_id)
 
         if target_row == -1:
             logger.error(f"Tried looking up {song.track_id} in the model, but it wasn't there?")
@@ -618,6 +700,11 @@ class StandardSyncWindow(QtWidgets.QWidget, Ui_StandardSyncWindow):
         # Update statistics labels
         self.update_statistics_labels()
     
+    @property
+    def stats_songs(self):
+        """The songs statistics are looked up in, by track ID."""
+        return self.lib.songs
+
     def update_statistics_labels(self):
         """
         Update labels from self.stats. 
@@ -724,8 +811,7 @@ class IgnoredSongsDialog(QtWidgets.QDialog, Ui_IgnoredSongsDialog):
 
         # The current songs present in the new songs table. Prevents songs from being added twice through this dialog
         # into the new songs table.
-        current_data = self.parent().new_songs_table.table_model.array_data
-        existing_track_ids = [row[0] for row in current_data]
+        new_songs_model = self.parent().new_songs_table.table_model
 
         # Generate data
         data = []
@@ -738,8 +824,8 @@ class IgnoredSongsDialog(QtWidgets.QDialog, Ui_IgnoredSongsDialog):
                 logger.info(f"Failed to look up {ignored_song.persistent_id} when building the IgnoredSongsDialog table, was it deleted?")
                 continue
 
-            # Check if it is already in the new songs table (which is, unfortunately, a linear search)
-            if song.track_id not in existing_track_ids:
+            # Check if it is already in the new songs table
+            if new_songs_model.find_row(song.track_id) == -1:
                 # get all the needed data, mark its tracking box as off by default
                 data.append([song.track_id, 0, song.name, song.artist, song.album, song.play_count, song.location])
 
@@ -750,7 +836,8 @@ class IgnoredSongsDialog(QtWidgets.QDialog, Ui_IgnoredSongsDialog):
 
         column_sizes = [50, 80, 200, 120, 120, 50, 200]
 
-        self.ignored_song_table.setup(headers, data, box_columns, filter_on)
+        self.ignored_song_table.setup(headers, box_columns, filter_on)
+        self.ignored_song_table.set_data(data)
         self.ignored_song_table.set_column_widths(column_sizes)
 
     def accept(self):
@@ -770,15 +857,12 @@ class IgnoredSongsDialog(QtWidgets.QDialog, Ui_IgnoredSongsDialog):
         # Generate the 2D array containing the data needed
         new_data = bpsynctools.first_sync_array_from_libpysongs(unignored_songs)
 
-        # Get the parent's table's underlying model data for the new songs table
-        current_data = self.parent().new_songs_table.table_model.array_data
+        # Append to the parent's new songs table, which only inserts the new rows
+        self.parent().new_songs_table.table_model.append_rows(new_data)
 
-        # Append to this underlying model data
-        # note: [[1, 2], [3, 4]] + [[5, 6], [7, 8]] = [[1, 2], [3, 4], [5, 6], [7, 8]]
-        current_data += new_data
-
-        # Update the table with this new data
-        self.parent().new_songs_table.set_data(current_data)
+        # The new rows are tracked/processed by default, so count them
+        self.parent().stats += bpsynctools.get_statistics(new_data, self.parent().lib, 2, 1)
+        self.parent().update_statistics_labels()
         
         # Call super
         super().accept()
@@ -819,8 +903,12 @@ class ExportImportWindow(QtWidgets.QWidget, Ui_ExportImportWindow):
                               "No XML path defined")
             return
         # generate library from it
+        # (snapshots are kept in the data directory, if a database has been opened this session)
+        cache_folder = None
+        if models.get_data_directory():
+            cache_folder = os.path.join(models.get_data_directory(), bpsynctools.LIBRARY_CACHE_FOLDER_NAME)
         try:
-            self.lib = Library(xml_path)
+            self.lib = bpsynctools.load_library(xml_path, cache_folder)
         except xml.parsers.expat.ExpatError as e:
             bpsynctools.show_error_window("Invalid XML file!",
                               f"Couldn't parse XML file (if it is one) - {e}",
@@ -905,6 +993,9 @@ class ExportImportWindow(QtWidgets.QWidget, Ui_ExportImportWindow):
 
 
 if __name__ == "__main__":
+    # Lets a frozen build start the song processing workers instead of relaunching the GUI
+    multiprocessing.freeze_support()
+
     app = QtWidgets.QApplication(sys.argv)
 
     window = MainMenuWindow()
@@ -10,11 +10,19 @@ in the future, if it's ever necessary to make this more robust:
 
 import logging
 import os
+import sqlite3
 import hashlib
+import threading
+from datetime import datetime
+from itertools import compress
+from operator import attrgetter, itemgetter, ne
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 
-from sqlalchemy import Table, Column, Integer, String, Boolean, Text
-from sqlalchemy import create_engine
+from sqlalchemy import Table, Column, Integer, String, Boolean, Text, DateTime, Index
+from sqlalchemy import create_engine, delete, event, func, select
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from sqlalchemy.orm import declarative_base, sessionmaker
 
@@ -27,6 +35,41 @@ engine = None
 Session = None
 Base = declarative_base()
 
+# Path of the database file the engine is connected to
+database_path = None
+# Guards (re)initialization of the engine, which can be requested from worker threads
+_engine_lock = threading.Lock()
+
+# Applied to every new connection. WAL lets the UI thread read while a worker writes,
+# and with WAL, synchronous=NORMAL is still safe against corruption.
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "cache_size=-65536",  # 64 MiB (negative values are in KiB)
+    "mmap_size=268435456",  # 256 MiB
+    "temp_store=MEMORY",
+)
+
+# Number of rows sent per executemany() call when bulk upserting. Keeps each
+# statement's parameter list (and memory use) bounded on large libraries.
+UPSERT_CHUNK_SIZE = 5000
+
+# Read size used when hashing files. Large reads mean far fewer calls into hashlib
+# (which releases the GIL while hashing) and far fewer read syscalls.
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# Song fields that require a reprocess when changed; see StoredSong.needs_reprocessing().
+# although not exactly pretty, maybe there's a better way
+# the fields that require a reprocess are unlikely to ever change
+# (i.e., track number will not suddenly stop being an ID3 tag)
+REPROCESSING_FIELDS = ("start_time", "stop_time", "disc_number", "disc_count",
+                       "track_number", "track_count", "year", "bit_rate",
+                       "sample_rate", "volume_adjustment", "compilation",
+                       "track_type", "name", "artist", "album_artist",
+                       "composer", "album", "grouping", "genre",
+                       "kind", "sort_album", "work", "movement_name",
+                       "movement_number", "movement_count")
+
 class StoredSong(Base):
     """Main class representing a tracked song"""
     __tablename__ = 'songs'
@@ -99,7 +142,7 @@ class StoredSong(Base):
         
         self.last_playcount = libpysong.play_count if libpysong.play_count else 0
 
-        self.blake2b_hash = calculate_file_hash(libpysong.location)
+        self.blake2b_hash = get_file_hash(libpysong.location)
 
         # The rest are all nullable, so None is ok to assign
         # It's also valid to be comparing null/None, since a change
@@ -139,25 +182,13 @@ class StoredSong(Base):
         These fields indicate a change in a tag that needs to be reflected in BlackPlayer,
         and therefore the song should be reprocessed.
         """
-        # although not exactly pretty, maybe there's a better way
-        # the fields that require a reprocess are unlikely to ever change
-        # (i.e., track number will not suddenly stop being an ID3 tag)
-
-        fields_to_test = ["start_time", "stop_time", "disc_number", "disc_count",
-                          "track_number", "track_count", "year", "bit_rate",
-                          "sample_rate", "volume_adjustment", "compilation", 
-                          "track_type", "name", "artist", "album_artist", 
-                          "composer", "album", "grouping", "genre", 
-                          "kind", "sort_album", "work", "movement_name",
-                          "movement_number", "movement_count"]
-
-        for field_name in fields_to_test:
+        for field_name in REPROCESSING_FIELDS:
             if getattr(self, field_name) != getattr(libpysong, field_name):
                 logger.info(f"{self.name} ({self.persistent_id}) needs reprocessing because {field_name} is different")
                 return True
         
         # Only try checking for file hash if explicitly requested
-        if calculate_file_hash and self.blake2b_hash != calculate_file_hash(libpysong.location):
+        if calculate_file_hash and self.blake2b_hash != get_file_hash(libpysong.location):
             logger.info(f"{self.name} ({self.persistent_id}) needs reprocessing because the hash has changed")
             return True
         
@@ -166,6 +197,57 @@ class StoredSong(Base):
         # Not supported
         # or self.equalizer != libpysong.equalizer \
 
+def batch_needs_reprocessing(stored_songs, libpysongs, calculate_file_hash=False):
+    """
+    Run StoredSong.needs_reprocessing() over many songs at once.
+
+    Every song's fields are gathered into one tuple per side (with itemgetter/attrgetter over
+    all of REPROCESSING_FIELDS) and the tuples are compared with operator.ne, all through map()
+    and itertools.compress(), so the per-song and per-field work stays in C. Only songs that
+    actually differ are visited in Python, to find which field changed first.
+
+    :param stored_songs: A sequence of StoredSong objects.
+    :param libpysongs: A sequence of libpytunes Song objects, aligned with `stored_songs`.
+    :param calculate_file_hash: Whether to also compare file hashes.
+
+    Returns two lists aligned with the inputs: a boolean mask of the songs that need
+    reprocessing, and the name of the first differing field for each song (None if
+    nothing differs, or "blake2b_hash" if only the file changed).
+    """
+    if len(stored_songs) != len(libpysongs):
+        raise ValueError("stored_songs and libpysongs must be the same length")
+
+    first_fields = [None] * len(stored_songs)
+
+    get_fields = attrgetter(*REPROCESSING_FIELDS)
+    try:
+        # The ORM keeps loaded column values in each StoredSong's __dict__. Reading them from
+        # there skips its attribute descriptors, which are most of the cost of comparing every field
+        stored_values = list(map(itemgetter(*REPROCESSING_FIELDS), map(vars, stored_songs)))
+    except KeyError:
+        # Some attribute was expired or never loaded, so let the ORM load it
+        stored_values = list(map(get_fields, stored_songs))
+
+    differs = map(ne, stored_values, map(get_fields, libpysongs))
+    for row in compress(range(len(stored_songs)), differs):
+        stored_song, libpysong = stored_songs[row], libpysongs[row]
+        first_fields[row] = next((field_name for field_name in REPROCESSING_FIELDS
+                                  if getattr(stored_song, field_name) != getattr(libpysong, field_name)), None)
+
+    # Only try checking for file hash if explicitly requested
+    if calculate_file_hash:
+        for row, (stored_song, libpysong) in enumerate(zip(stored_songs, libpysongs)):
+            if first_fields[row] is None and stored_song.blake2b_hash != get_file_hash(libpysong.location):
+                first_fields[row] = "blake2b_hash"
+
+    for stored_song, field_name in zip(stored_songs, first_fields):
+        if field_name:
+            logger.info(f"{stored_song.name} ({stored_song.persistent_id}) needs reprocessing because {field_name} is different")
+
+    mask = [field_name is not None for field_name in first_fields]
+
+    return mask, first_fields
+
 class IgnoredSong(Base):
     """
     Class used for self.storing songs unselected for self.tracking.
@@ -177,55 +259,329 @@ class IgnoredSong(Base):
 
     persistent_id = Column(String(20), primary_key=True)
 
+class SyncEvent(Base):
+    """
+    One song's playcount reconciliation during one sync.
+
+    This table is append-only: each standard sync adds one row per tracked song, all sharing
+    the same sync_id, so the history of every song's playcount can be audited (or rolled back)
+    without the backups made by create_backup().
+    """
+    __tablename__ = 'sync_events'
+
+    id = Column(Integer, primary_key=True)
+    # Incrementing number of the sync this event belongs to
+    sync_id = Column(Integer, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+    persistent_id = Column(String(20), nullable=False)
+
+    base_playcount = Column(Integer, nullable=False)  # StoredSong.last_playcount before the sync
+    xml_playcount = Column(Integer, nullable=False)
+    bpstat_playcount = Column(Integer, nullable=False)
+    delta = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        # "History for one song", in order
+        Index('ix_sync_events_persistent_id_sync_id', 'persistent_id', 'sync_id'),
+        # "What changed in sync N"
+        Index('ix_sync_events_sync_id', 'sync_id'),
+    )
+
+    def __repr__(self):
+        return f"{self.sync_id=} {self.persistent_id=} {self.base_playcount=} {self.delta=}"
+
+class FileHash(Base):
+    """
+    A previously calculated file hash.
+
+    The hash is only valid for as long as the file's size, modification time and inode
+    are unchanged; see FileHashCache.
+    """
+    __tablename__ = 'filehashes'
+
+    path = Column(Text, primary_key=True)
+    size = Column(Integer, nullable=False)
+    mtime_ns = Column(Integer, nullable=False)
+    # Stored as text, since inode numbers on some platforms don't fit in a signed 64-bit integer
+    inode = Column(String(20), nullable=False)
+    blake2b_hash = Column(String(128), nullable=False)
+
+class FileHashCache:
+    """
+    In-memory copy of the FileHash table, used to avoid rehashing files that haven't changed.
+
+    The whole table is read in one query the first time a hash is requested. Files are
+    then only opened and hashed if their stat tuple (size, mtime_ns, inode) differs from
+    the cached one. New hashes are kept in memory until save() is called.
+    """
+    def __init__(self):
+        # path: (size, mtime_ns, inode, blake2b_hash)
+        self.entries = {}
+        # Entries that have been calculated since the last save()
+        self.changed = {}
+        self.loaded = False
+
+    def load(self):
+        """Read all cached hashes from the database."""
+        # Databases created before this table existed won't have it yet
+        FileHash.__table__.create(engine, checkfirst=True)
+
+        with Session() as session:
+            self.entries = {row.path: (row.size, row.mtime_ns, row.inode, row.blake2b_hash)
+                            for row in session.query(FileHash)}
+        self.loaded = True
+
+        logger.info(f"Loaded {len(self.entries)} cached file hashes")
+
+    def get_hash(self, filepath):
+        """
+        Return the hash of the file at `filepath`, only hashing it if it has changed.
+
+        :param filepath: The path of the file to hash.
+        """
+        if not self.loaded and Session:
+            self.load()
+
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            return "FILE_NOT_AVAILABLE"
+
+        stat_key = (stat.st_size, stat.st_mtime_ns, str(stat.st_ino))
+        cached = self.entries.get(filepath)
+        if cached and cached[:3] == stat_key:
+            return cached[3]
+
+        file_hash = calculate_file_hash(filepath)
+        if file_hash != "FILE_NOT_AVAILABLE":
+            self.entries[filepath] = self.changed[filepath] = (*stat_key, file_hash)
+
+        return file_hash
+
+    def prefetch(self, filepaths, max_workers=None, progress_callback=None):
+        """
+        Hash every file in `filepaths` that isn't already cached, several files at a time.
+
+        Reading and hashing both release the GIL, so the files are hashed concurrently
+        on a thread pool. Afterwards, get_hash() is a cache hit for all of these files.
+
+        :param filepaths: An iterable of paths to hash.
+        :param max_workers: The number of hashing threads. Defaults to ThreadPoolExecutor's default.
+        :param progress_callback: Optional function called as
+            `progress_callback(files_done, total_files, bytes_done, total_bytes)`. It is
+            always called from the calling thread, so it is safe to update widgets from it.
+        """
+        if not self.loaded and Session:
+            self.load()
+
+        # Figure out which files actually need hashing, and how many bytes that is
+        stale = {}
+        for filepath in filepaths:
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                continue
+
+            stat_key = (stat.st_size, stat.st_mtime_ns, str(stat.st_ino))
+            cached = self.entries.get(filepath)
+            if not cached or cached[:3] != stat_key:
+                stale[filepath] = stat_key
+
+        total_files = len(stale)
+        total_bytes = sum(stat_key[0] for stat_key in stale.values())
+        if not stale:
+            return
+
+        logger.info(f"Hashing {total_files} files ({total_bytes} bytes)...")
+
+        bytes_done = 0
+        lock = threading.Lock()
+
+        def add_bytes(num_bytes):
+            nonlocal bytes_done
+            with lock:
+                bytes_done += num_bytes
+
+        files_done = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(calculate_file_hash, filepath, add_bytes): filepath
+                       for filepath in stale}
+            pending = set(futures)
+
+            while pending:
+                # Wake up periodically so that per-byte progress is reported even
+                # while large files are still being hashed
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    filepath = futures[future]
+                    file_hash = future.result()
+                    if file_hash != "FILE_NOT_AVAILABLE":
+                        self.entries[filepath] = self.changed[filepath] = (*stale[filepath], file_hash)
+                    files_done += 1
+
+                if progress_callback:
+                    progress_callback(files_done, total_files, bytes_done, total_bytes)
+
+    def save(self):
+        """Write all hashes calculated since the last save to the database."""
+        if not self.changed or not Session:
+            return
+
+        logger.info(f"Saving {len(self.changed)} file hashes...")
+        upsert_rows(FileHash.__table__,
+                    [{"path": path, "size": size, "mtime_ns": mtime_ns, "inode": inode, "blake2b_hash": blake2b_hash}
+                     for path, (size, mtime_ns, inode, blake2b_hash) in self.changed.items()])
+
+        self.changed = {}
+
+# Replaced whenever the engine is (re)initialized, since it belongs to a specific database
+file_hash_cache = FileHashCache()
+
 def initialize_engine(filepath):
     """
     Initialize the engine to the specified path, where songs.db is the default filename.
     
     This *must* be called before performing any database actions.
 
-    Also initializes a sessionmaker."""
-    global engine, Session
+    Also initializes a sessionmaker. The engine and sessionmaker are shared by every thread;
+    each thread should still use its own Session. Calling this again with the same database
+    keeps the existing engine, so it's safe to call from worker threads.
+    """
+    global engine, Session, file_hash_cache, database_path
 
     # if we were given a file instead of a directory, then use that full filepath
     # but if we were just given a directory, then create an engine with songs.db.
     # This also implicitly makes the database file if it does not already exist.
-
     if os.path.isfile(filepath):
-        #engine = create_engine(f"sqlite+pysqlite:///{filepath}", echo=True, future=True)
-        engine = create_engine(f"sqlite+pysqlite:///{filepath}", future=True)
+        output_path = os.path.abspath(filepath)
     else:
-        output_path = os.path.join(filepath, "songs.db")
+        output_path = os.path.abspath(os.path.join(filepath, "songs.db"))
+
+    with _engine_lock:
+        if engine is not None and output_path == database_path:
+            return
+
+        if engine is not None:
+            logger.info(f"Switching database from {database_path} to {output_path}")
+            engine.dispose()
+
         #engine = create_engine(f"sqlite+pysqlite:///{output_path}", echo=True, future=True)
-        engine = create_engine(f"sqlite+pysqlite:///{output_path}", future=True)
-    Session = sessionmaker(engine)
+        # check_same_thread=False allows pooled connections to be handed to whichever thread
+        # (UI or QThreadPool worker) checks them out next; a connection is never used by two
+        # threads at once.
+        engine = create_engine(f"sqlite+pysqlite:///{output_path}", future=True,
+                               poolclass=QueuePool, pool_size=5, max_overflow=5,
+                               connect_args={"check_same_thread": False})
+        event.listen(engine, "connect", _apply_sqlite_pragmas)
+
+        Session = sessionmaker(engine)
+        file_hash_cache = FileHashCache()
+        database_path = output_path
+
+def get_data_directory():
+    """
+    Return the directory holding the database the engine is connected to.
+
+    Per-sync files (fingerprints, library snapshots) are kept alongside the database.
+    Returns None if initialize_engine() hasn't been called yet.
+    """
+    if database_path is None:
+        return None
+    return os.path.dirname(database_path)
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply SQLITE_PRAGMAS to a new DBAPI connection."""
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
 
 def create_db():
     """
-    Create a new database from an array of libpytunes Song objects.
-    
-    Should only be used on first-time sync, where the database does not already exist.
+    Create any tables that don't exist yet in the database.
+
+    Tables that already exist are left untouched, so this is safe to call on an existing database.
     """
     Base.metadata.create_all(engine)
 
-def add_libpy_songs(songs):
-    """Commit an array of libpytunes Song objects to the database."""
+def upsert_rows(table, rows, connection=None):
+    """
+    Insert rows into a table, updating the existing row wherever the primary key already exists.
+
+    Uses SQLite's `INSERT ... ON CONFLICT DO UPDATE`, executed with executemany() in chunks
+    of UPSERT_CHUNK_SIZE, all in one transaction.
+
+    :param table: The sqlalchemy Table to write to.
+    :param rows: A list of dicts of column names to values. Every dict must have the same keys.
+    :param connection: A connection with a transaction already open, to write as part of that
+        transaction. If None, the rows are written in a transaction of their own.
+    """
+    if not rows:
+        return
+
+    if connection is None:
+        with engine.begin() as connection:
+            upsert_rows(table, rows, connection)
+        return
+
+    primary_key = [column.name for column in table.primary_key.columns]
+    statement = sqlite_insert(table)
+    update_columns = {name: statement.excluded[name] for name in rows[0] if name not in primary_key}
+    if update_columns:
+        statement = statement.on_conflict_do_update(index_elements=primary_key, set_=update_columns)
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=primary_key)
+
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        connection.execute(statement, rows[start:start + UPSERT_CHUNK_SIZE])
+
+def stored_song_row(libpysong):
+    """
+    Get the StoredSong column values for a libpytunes Song object, as a dict.
+
+    Equivalent to StoredSong.update_from_libpy_song(), but without creating an ORM object.
+    """
+    row = {field_name: getattr(libpysong, field_name) for field_name in REPROCESSING_FIELDS}
+    row["persistent_id"] = libpysong.persistent_id
+    row["last_playcount"] = libpysong.play_count if libpysong.play_count else 0
+    row["blake2b_hash"] = get_file_hash(libpysong.location)
+    row["equalizer"] = libpysong.equalizer
+
+    return row
+
+def add_libpy_songs(songs, sync_events=None):
+    """
+    Commit an array of libpytunes Song objects to the database.
+
+    Songs that are already in the database are updated instead.
+
+    :param sync_events: If given, the playcount changes to record with record_sync_events(),
+        in the same transaction as the songs.
+    """
     # If playcount field isn't present, it's implied to be 0
 
     logger.info(f"Adding {len(songs)} to database...")
 
-    new_songs = []
-    for song in songs:
-        logger.info(f"Creating StoredSong object for {song.persistent_id=}...")
-        new_song = StoredSong()
+    add_stored_song_rows([stored_song_row(song) for song in songs], sync_events)
 
-        new_song.update_from_libpy_song(song)
+def add_stored_song_rows(rows, sync_events=None):
+    """
+    Commit StoredSong rows made by stored_song_row() to the database, in one transaction.
 
-        new_songs.append(new_song)
+    Songs that are already in the database are updated instead.
 
-    with Session() as session:
-        logger.info("Saving new database elements...")
-        session.bulk_save_objects(new_songs)
-        session.commit()
+    :param sync_events: If given, the playcount changes to record with record_sync_events(),
+        in the same transaction as the rows.
+    """
+    logger.info("Saving new database elements...")
+    # Either everything is committed or nothing is
+    with engine.begin() as connection:
+        upsert_rows(StoredSong.__table__, rows, connection)
+        if sync_events is not None:
+            record_sync_events(sync_events, connection)
+
+    file_hash_cache.save()
 
     logger.info("New songs committed.")
 
@@ -233,28 +589,118 @@ def add_ignored_ids(song_ids):
     """
     Commit an array of persistent IDs to be excluded from the
     "new songs" table in a standard sync.
+
+    IDs that are already ignored are skipped.
+    """
+    logger.info(f"Saving IgnoredSong objects...")
+    upsert_rows(IgnoredSong.__table__, [{"persistent_id": song_id} for song_id in song_ids])
+
+def remove_ignored_ids(song_ids):
+    """
+    Stop ignoring an array of persistent IDs, i.e. because they're now being tracked.
+    """
+    song_ids = list(song_ids)
+
+    # Older SQLite versions allow at most 999 parameters in one statement, i.e. the IN list
+    chunk_size = 500
+
+    with engine.begin() as connection:
+        for start in range(0, len(song_ids), chunk_size):
+            chunk = song_ids[start:start + chunk_size]
+            result = connection.execute(delete(IgnoredSong.__table__).where(IgnoredSong.persistent_id.in_(chunk)))
+            if result.rowcount:
+                logger.info(f"Removed {result.rowcount} now-tracked songs from the ignored songs database")
+
+def record_sync_events(events, connection=None):
     """
-    ignored_song_ids = [IgnoredSong(persistent_id=song_id)
-                 for song_id in song_ids]
+    Append the playcount changes of one sync to the sync_events table, in a single transaction.
+
+    :param events: A list of dicts with the keys persistent_id, base_playcount,
+        xml_playcount, bpstat_playcount and delta.
+    :param connection: A connection with a transaction already open, to write as part of that
+        transaction. If None, the events are written in a transaction of their own.
+
+    Returns the sync ID assigned to these events.
+    """
+    if connection is None:
+        with engine.begin() as connection:
+            return record_sync_events(events, connection)
+
+    # Databases created before this table existed won't have it yet
+    SyncEvent.__table__.create(connection, checkfirst=True)
 
+    timestamp = datetime.now()
+    last_sync_id = connection.execute(select(func.max(SyncEvent.sync_id))).scalar()
+    sync_id = (last_sync_id or 0) + 1
+
+    rows = [dict(sync_event, sync_id=sync_id, timestamp=timestamp) for sync_event in events]
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        connection.execute(SyncEvent.__table__.insert(), rows[start:start + UPSERT_CHUNK_SIZE])
+
+    logger.info(f"Recorded {len(events)} playcount changes as sync {sync_id}")
+
+    return sync_id
+
+def get_song_history(persistent_id):
+    """Get every SyncEvent for a song, oldest first."""
     with Session() as session:
-        logger.info(f"Saving IgnoredSong objects...")
-        session.bulk_save_objects(ignored_song_ids)
-        session.commit()
+        return session.scalars(select(SyncEvent)
+                               .where(SyncEvent.persistent_id == persistent_id)
+                               .order_by(SyncEvent.sync_id)).all()
+
+def get_sync_events(sync_id):
+    """Get every SyncEvent recorded by one sync."""
+    with Session() as session:
+        return session.scalars(select(SyncEvent).where(SyncEvent.sync_id == sync_id)).all()
+
+def backup_database(output_path):
+    """
+    Copy the database the engine is connected to into `output_path`.
+
+    Uses SQLite's backup API instead of copying songs.db, since with WAL enabled
+    committed changes can still be sitting in songs.db-wal.
+    """
+    source = sqlite3.connect(database_path)
+    target = sqlite3.connect(output_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
 
 def commit_changes():
     """Commit changes to database."""
     with Session() as session:
         session.commit()
 
-def calculate_file_hash(filepath) -> str:
+def get_file_hash(filepath) -> str:
+    """
+    Get the hash of a file, using the file hash cache of the current database.
+
+    Prefer this over calculate_file_hash(), which always reads the whole file.
+    """
+    return file_hash_cache.get_hash(filepath)
+
+def calculate_file_hash(filepath, progress_callback=None) -> str:
+    """
+    Hash the entire file at `filepath` with BLAKE2b.
+
+    :param filepath: The path of the file to hash.
+    :param progress_callback: Optional function called with the number of bytes
+        hashed after every read.
+    """
     # https://stackoverflow.com/questions/16874598/how-do-i-calculate-the-md5-checksum-of-a-file-in-python
 
     try:
-        with open(filepath, "rb") as f:
+        with open(filepath, "rb", buffering=0) as f:
             file_hash = hashlib.blake2b()
-            while chunk := f.read(8192):
-                file_hash.update(chunk)
+            # Reuse one buffer for every read instead of allocating a new bytes object each time
+            buffer = bytearray(HASH_BUFFER_SIZE)
+            view = memoryview(buffer)
+            while num_read := f.readinto(buffer):
+                file_hash.update(view[:num_read])
+                if progress_callback:
+                    progress_callback(num_read)
     except FileNotFoundError:
         # Return a placeholder hash.
         # If the file doesn't exist for some reason, but the user
@@ -262,4 +708,4 @@ def calculate_file_hash(filepath) -> str:
         # just put a placeholder hash here instead.
         return "FILE_NOT_AVAILABLE"
 
-    return file_hash.hexdigest() # len = 128
\ No newline at end of file
+    return file_hash.hexdigest() # len = 128